@@ -0,0 +1,157 @@
+import datetime
+import struct
+import threading
+import time
+from typing import Iterator, List, Optional, Tuple
+
+import pymongo
+
+from logger import logger
+from metrics import metrics
+from routing import Route, SheetRouter
+from table import TERMS_LENGTH, TurnipPriceTableViewService
+
+# the week starts at 5:00 on Sunday like the game, see parse.parse_update_command
+ROLLOVER_WEEKDAY = 6
+ROLLOVER_HOUR = 5
+# 買値, 月AM, ..., 土PM as little-endian int16, -1 for blank
+PRICES_FORMAT = struct.Struct("<%dh" % TERMS_LENGTH)
+MISSING_PRICE = -1  # same as price_matrix.MISSING
+
+
+class ArchiveService:
+    """
+    archive prices of past weeks in MongoDB.
+
+    a document is {"spreadsheet", "sheet", "name", "week", "prices"} per member and week,
+    where week is the Sunday of the week in ISO format
+    and prices are packed by PRICES_FORMAT.
+    """
+
+    def __init__(self, col: pymongo.collection.Collection, batch_size: int = 1000):
+        self.collection = col
+        self.batch_size = batch_size
+
+    def ensure_index(self):
+        self.collection.create_index(
+            [
+                ("spreadsheet", pymongo.ASCENDING),
+                ("sheet", pymongo.ASCENDING),
+                ("name", pymongo.ASCENDING),
+                ("week", pymongo.DESCENDING),
+            ],
+            unique=True,
+        )
+
+    @metrics.timed("archive_archive")
+    def archive(self, route: Route, week: datetime.date, table: List[List[str]]) -> int:
+        """
+        write the prices of the members in the table as the week, batch_size documents
+        per bulk_write. it replaces the documents of the week if already archived.
+        returns the number of archived members.
+        """
+        count = 0
+        batch = []
+        for doc in documents(route, week, table):
+            batch.append(
+                pymongo.ReplaceOne(
+                    {key: doc[key] for key in ("spreadsheet", "sheet", "name", "week")},
+                    doc,
+                    upsert=True,
+                )
+            )
+            if len(batch) >= self.batch_size:
+                self.collection.bulk_write(batch, ordered=False)
+                count += len(batch)
+                batch = []
+        if batch:
+            self.collection.bulk_write(batch, ordered=False)
+            count += len(batch)
+        logger.info("archived %d members of %s as the week of %s", count, route, week)
+        return count
+
+    @metrics.timed("archive_find_weeks")
+    def find_weeks(
+        self, route: Route, name: str, weeks: int
+    ) -> List[Tuple[str, List[Optional[int]]]]:
+        """
+        the last weeks of the member, the latest first
+        """
+        cursor = (
+            self.collection.find(
+                {"spreadsheet": route.spreadsheet, "sheet": route.sheet, "name": name},
+                {"_id": False, "week": True, "prices": True},
+            )
+            .sort("week", pymongo.DESCENDING)
+            .limit(weeks)
+        )
+        return [(doc["week"], unpack_prices(doc["prices"])) for doc in cursor]
+
+    def start_rollover(self, router: SheetRouter) -> threading.Thread:
+        """
+        archive the worksheets of all routes at every rollover in a daemon thread
+        """
+
+        def run():
+            while True:
+                now = datetime.datetime.now()
+                rollover = next_rollover(now)
+                time.sleep((rollover - now).total_seconds())
+                week = week_start(rollover - datetime.timedelta(days=1))
+                for route in router.routes():
+                    try:
+                        table = router.service(route).get_table(route.sheet)
+                        self.archive(route, week, table)
+                    except Exception as e:
+                        logger.error(
+                            "failed to archive %s. error: %s", route, e, exc_info=True
+                        )
+
+        thread = threading.Thread(target=run, name="archive-rollover", daemon=True)
+        thread.start()
+        return thread
+
+
+def documents(
+    route: Route, week: datetime.date, table: List[List[str]]
+) -> Iterator[dict]:
+    """
+    documents of the members who have any price in the table
+    """
+    matrix = TurnipPriceTableViewService(table).price_matrix()
+    if matrix is None:
+        return
+    # the matrix is int16 like PRICES_FORMAT, so rows are packed as they are.
+    # prices out of int16 are already MISSING, so one broken cell doesn't stop the rollover
+    packed = matrix.prices.astype("<i2")
+    observed = matrix.observed().any(axis=1)
+    for name, index in matrix.indexes.items():
+        if name.strip() == "" or not observed[index]:
+            continue
+        yield {
+            "spreadsheet": route.spreadsheet,
+            "sheet": route.sheet,
+            "name": name,
+            "week": week.isoformat(),
+            "prices": packed[index].tobytes(),
+        }
+
+
+def unpack_prices(data: bytes) -> List[Optional[int]]:
+    return [
+        None if price == MISSING_PRICE else price
+        for price in PRICES_FORMAT.unpack(bytes(data))
+    ]
+
+
+def week_start(time_: datetime.datetime) -> datetime.date:
+    """
+    the Sunday of the week containing time_
+    """
+    date = (time_ - datetime.timedelta(hours=ROLLOVER_HOUR)).date()
+    return date - datetime.timedelta(days=(date.weekday() - ROLLOVER_WEEKDAY) % 7)
+
+
+def next_rollover(now: datetime.datetime) -> datetime.datetime:
+    start = week_start(now) + datetime.timedelta(days=7)
+    return datetime.datetime.combine(start, datetime.time(ROLLOVER_HOUR))
@@ -0,0 +1,71 @@
+"""
+benchmark of BindService lookups against pymongo_inmemory
+
+usage: python3 bench_bind.py [--lookups N] [--sizes 100,1000,10000,100000]
+"""
+
+import random
+import statistics
+import time
+from optparse import OptionParser
+from typing import List
+
+import pymongo_inmemory
+
+from bind import BindService
+
+
+def measure(service: BindService, ids: List[int]) -> List[float]:
+    latencies = []
+    for id_ in ids:
+        start = time.perf_counter()
+        service.find_name(id_)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def report(label: str, size: int, latencies: List[float]):
+    latencies = sorted(latencies)
+    print(
+        "{:<10} {:>7} bindings: mean {:8.1f}us p50 {:8.1f}us p99 {:8.1f}us".format(
+            label,
+            size,
+            statistics.mean(latencies) * 1e6,
+            latencies[len(latencies) // 2] * 1e6,
+            latencies[int(len(latencies) * 0.99)] * 1e6,
+        )
+    )
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option("--lookups", dest="lookups", type="int", default=1000)
+    parser.add_option("--sizes", dest="sizes", default="100,1000,10000,100000")
+    option, _ = parser.parse_args()
+    sizes = [int(size) for size in option.sizes.split(",")]
+
+    client = pymongo_inmemory.MongoClient()
+    try:
+        for size in sizes:
+            collection = client["bench"]["name_binding_%d" % size]
+            collection.drop()
+            collection.insert_many(
+                [{"id": i, "name": "user%d" % i} for i in range(size)]
+            )
+            ids = [random.randrange(size) for _ in range(option.lookups)]
+
+            # cache_size=0 to measure MongoDB itself
+            uncached = BindService(collection, cache_size=0)
+            report("no index", size, measure(uncached, ids))
+            uncached.ensure_index()
+            report("index", size, measure(uncached, ids))
+
+            cached = BindService(collection, cache_size=size)
+            cached.preload()
+            report("cache", size, measure(cached, ids))
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+micro benchmark of parse.normalize against the jaconv implementation
+
+usage: python3 bench_normalize.py [--repeat N]
+"""
+
+import time
+from optparse import OptionParser
+from typing import Callable, List
+
+import jaconv
+
+import parse
+from bench_parse import COMMANDS
+
+
+def normalize_jaconv(command: str) -> str:
+    """
+    parse.normalize before the translate table
+    """
+    command = command.strip()
+    command = jaconv.z2h(command, kana=False, digit=True, ascii=True)
+    command = command.lower()
+    command = command.strip()
+    return command
+
+
+def measure(label: str, repeat: int, corpus: List[str], function: Callable):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for command in corpus:
+            function(command)
+    elapsed = time.perf_counter() - start
+    count = repeat * len(corpus)
+    print("{:<24} {:8.3f}us/command".format(label, elapsed / count * 1e6))
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option("--repeat", dest="repeat", type="int", default=10000)
+    option, _ = parser.parse_args()
+
+    for command in COMMANDS:
+        if parse.normalize(command) != normalize_jaconv(command):
+            raise ValueError("normalize differs for %r" % command)
+
+    ascii_corpus = [command for command in COMMANDS if command.isascii()]
+    zenkaku_corpus = [command for command in COMMANDS if not command.isascii()]
+    for label, corpus in [
+        ("all", COMMANDS),
+        ("ascii", ascii_corpus),
+        ("zenkaku", zenkaku_corpus),
+    ]:
+        measure("jaconv (%s)" % label, option.repeat, corpus, normalize_jaconv)
+        measure("translate (%s)" % label, option.repeat, corpus, parse.normalize)
+
+
+if __name__ == "__main__":
+    main()
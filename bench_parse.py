@@ -0,0 +1,84 @@
+"""
+throughput benchmark of ParseService.recognize and parse_update_command
+
+usage: python3 bench_parse.py [--messages N]
+"""
+
+import datetime
+import logging
+import time
+from optparse import OptionParser
+from types import SimpleNamespace
+from typing import Callable, List
+
+import parse
+
+BOT_ID = 1234
+COMMANDS = [
+    "+100",
+    "+ 100",
+    "+１００",
+    "+100 木曜AM",
+    "+１００　木ＡＭ",
+    "+木ａｍ　１００",
+    "+100 買い",
+    "+100 100/64 32/- -/- -/- -/- -/-",
+    "hist",
+    "pred",
+    "im しずえ",
+    "who",
+    "echo hello",
+    "",
+    "hello",
+]
+
+
+def message(content: str, mention: bool = True) -> SimpleNamespace:
+    bot = SimpleNamespace(id=BOT_ID)
+    return SimpleNamespace(
+        author=SimpleNamespace(bot=False),
+        content="<@!{}> {}".format(BOT_ID, content) if mention else content,
+        created_at=datetime.datetime(2020, 4, 15, 11, 30, 0),
+        mentions=[bot] if mention else [],
+    )
+
+
+def measure(label: str, count: int, inputs: List, function: Callable):
+    start = time.perf_counter()
+    for i in range(count):
+        function(inputs[i % len(inputs)])
+    elapsed = time.perf_counter() - start
+    print(
+        "{:<24} {:>10.0f} messages/s ({:.2f}us/message)".format(
+            label, count / elapsed, elapsed / count * 1e6
+        )
+    )
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option("--messages", dest="messages", type="int", default=100000)
+    option, _ = parser.parse_args()
+    # parse logs ignored messages and unspecified terms
+    logging.disable(logging.INFO)
+
+    service = parse.ParseService(SimpleNamespace(id=BOT_ID))
+    mentions = [message(command) for command in COMMANDS]
+    others = [message(command, mention=False) for command in COMMANDS]
+    current = datetime.datetime(2020, 4, 15, 11, 30, 0)
+    updates = [
+        parse.normalize(command[1:]) for command in COMMANDS if command[:1] == "+"
+    ]
+
+    measure("recognize (mention)", option.messages, mentions, service.recognize)
+    measure("recognize (ignored)", option.messages, others, service.recognize)
+    measure(
+        "parse_update_command",
+        option.messages,
+        updates,
+        lambda command: parse.parse_update_command(command, current),
+    )
+
+
+if __name__ == "__main__":
+    main()
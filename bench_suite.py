@@ -0,0 +1,201 @@
+"""
+benchmark of parse -> respond -> table with synthetic large sheets
+
+the sheet and MongoDB are replaced by in-memory stand-ins (localsheet.LocalWorksheet
+without latency), so this measures the bot itself.
+results are written as JSON to compare them across commits.
+
+usage: python3 bench_suite.py [--members 10,100,1000,10000] [--weeks 4] [--calls 200]
+                              [--cache-ttl 60] [--output bench_output.json]
+"""
+
+import datetime
+import json
+import logging
+import random
+import statistics
+import subprocess
+import time
+from optparse import OptionParser
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+
+import gspreads
+import parse
+import table
+from bind import BindService
+from localsheet import LocalWorksheet
+from respond import RespondService
+from routing import Route, SheetRouter, SpreadsheetPool
+
+BOT_ID = 1234
+COMMANDS = {
+    "update": "+100 月AM",
+    "hist": "hist",
+    "who": "who",
+    "top": "top",
+}
+
+
+def generate_table(members: int, weeks: int, seed: int = 0) -> List[List[str]]:
+    """
+    a sheet like testdata.tsv. the current week is the leftmost block
+    and the past weeks follow it on the right.
+    """
+    rng = random.Random(seed)
+    terms = [table.TERMS_ROW_IDENTIFIER] + table.SELL_TERMS
+    width = 2 + weeks * (len(terms) + 1)
+    header = ["カブ価は自動で入ります"] + [""] * (width - 1)
+    dates = [""] * width
+    labels = ["ID", table.USER_COLUMN_IDENTIFIER]
+    for _ in range(weeks):
+        labels += terms + [""]
+    rows = [header, dates, labels]
+    for i in range(members):
+        row = [str(i + 1), "user%d" % i]
+        for _ in range(weeks):
+            buy = rng.randint(90, 110)
+            row += [str(buy)]
+            row += [
+                str(rng.randint(30, 600)) if rng.random() < 0.8 else ""
+                for _ in table.SELL_TERMS
+            ]
+            row += [""]
+        rows.append(row)
+    return rows
+
+
+class FakeCollection:
+    """
+    pymongo collection stand-in for BindService
+    """
+
+    def __init__(self):
+        self.docs: Dict[int, dict] = {}
+
+    def create_index(self, key, unique=False):
+        pass
+
+    def find(self, filter_, projection=None):
+        return SimpleNamespace(limit=lambda n: list(self.docs.values())[:n])
+
+    def find_one(self, filter_, projection=None) -> Optional[dict]:
+        return self.docs.get(filter_["id"])
+
+    def replace_one(self, filter_, doc, upsert=False):
+        self.docs[filter_["id"]] = doc
+
+
+def message(content: str, author_id: int) -> SimpleNamespace:
+    bot = SimpleNamespace(id=BOT_ID)
+    return SimpleNamespace(
+        id=random.getrandbits(63),
+        author=SimpleNamespace(id=author_id, bot=False),
+        content="<@!{}> {}".format(BOT_ID, content),
+        created_at=datetime.datetime(2020, 4, 15, 11, 30, 0),
+        mentions=[bot],
+    )
+
+
+def summarize(latencies: List[float]) -> Dict[str, float]:
+    latencies = sorted(latencies)
+    total = sum(latencies)
+    return {
+        "calls": len(latencies),
+        "throughput": len(latencies) / total if total > 0 else 0.0,
+        "mean": statistics.mean(latencies),
+        "p50": latencies[len(latencies) // 2],
+        "p95": latencies[int(len(latencies) * 0.95)],
+        "p99": latencies[int(len(latencies) * 0.99)],
+    }
+
+
+def run(members: int, weeks: int, calls: int, cache_ttl: float) -> List[dict]:
+    rows = generate_table(members, weeks)
+    gspread = gspreads.GspreadService([LocalWorksheet(rows)], cache_ttl=cache_ttl)
+    binds = BindService(FakeCollection())
+    for i in range(members):
+        binds.bind(i, "user%d" % i)
+    parser = parse.ParseService(SimpleNamespace(id=BOT_ID))
+    pool = SpreadsheetPool(None)
+    pool.add("bench", gspread)
+    respond = RespondService(SheetRouter(pool, Route("bench")), binds)
+
+    results = []
+    raw_table = gspread.get_table(0)
+    start = time.perf_counter()
+    table.TurnipPriceTableViewService(raw_table)
+    results.append(
+        {
+            "members": members,
+            "weeks": weeks,
+            "cache_ttl": cache_ttl,
+            "command": "table_view",
+            **summarize([time.perf_counter() - start]),
+        }
+    )
+    for command, content in COMMANDS.items():
+        latencies = []
+        for i in range(calls):
+            m = message(content, random.randrange(members))
+            start = time.perf_counter()
+            request = parser.recognize(m)
+            respond.respond_to(m, request)
+            latencies.append(time.perf_counter() - start)
+        results.append(
+            {
+                "members": members,
+                "weeks": weeks,
+                "cache_ttl": cache_ttl,
+                "command": command,
+                **summarize(latencies),
+            }
+        )
+    return results
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option("--members", dest="members", default="10,100,1000,10000")
+    parser.add_option("--weeks", dest="weeks", type="int", default=4)
+    parser.add_option("--calls", dest="calls", type="int", default=200)
+    parser.add_option("--cache-ttl", dest="cache_ttl", type="float", default=60)
+    parser.add_option(
+        "--output", dest="output", default="bench_output.json", metavar="FILE"
+    )
+    option, _ = parser.parse_args()
+    logging.disable(logging.INFO)
+    random.seed(0)
+
+    results = []
+    for members in [int(m) for m in option.members.split(",")]:
+        for result in run(members, option.weeks, option.calls, option.cache_ttl):
+            print(
+                "{members:>6} members {command:<10} {throughput:>10.1f} calls/s "
+                "p50 {p50:.6f}s p99 {p99:.6f}s".format(**result)
+            )
+            results.append(result)
+
+    with open(option.output, "w") as f:
+        json.dump(
+            {
+                "commit": git_commit(),
+                "created_at": datetime.datetime.now().isoformat(),
+                "results": results,
+            },
+            f,
+            indent=2,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,141 @@
-from typing import Optional
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
 
 import pymongo
 
+from logger import logger
+from metrics import metrics
+
 
 class BindService:
     """
     bind id to name. it's injective, not one-to-one
+
+    bindings are cached in memory. the cache is preloaded by preload,
+    updated by bind (write-through) and holds at most cache_size ids (LRU).
+    when refresh_interval is given, start_refresher reloads the cache
+    every that many seconds in the background, so that bindings made
+    by other processes are eventually seen.
+    find_name never scans the collection, ids not in the cache are read by find_one.
     """
 
-    def __init__(self, col: pymongo.collection.Collection):
+    def __init__(
+        self,
+        col: pymongo.collection.Collection,
+        cache_size: int = 10000,
+        refresh_interval: Optional[float] = None,
+    ):
         self.collection = col
+        self.cache_size = cache_size
+        self.refresh_interval = refresh_interval
+        # id -> name, None if the id is not bound
+        self.cache: "OrderedDict[int, Optional[str]]" = OrderedDict()
+        self.loaded_at: Optional[float] = None
+        # bindings made while preload is scanning, merged into the new cache
+        self.bound_while_loading: Optional[Dict[int, str]] = None
+        # only one preload runs at a time
+        self.preload_lock = threading.Lock()
+        self.refresher: Optional[threading.Thread] = None
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.lock = threading.Lock()
+
+    def ensure_index(self):
+        """
+        create the unique index on id. it fails if the collection already has duplicates.
+        """
+        try:
+            self.collection.create_index("id", unique=True)
+        except pymongo.errors.OperationFailure as e:
+            logger.error(
+                "failed to create the unique index on id. remove duplicate bindings. error: %s",
+                e,
+            )
+
+    def preload(self):
+        """
+        load bindings from the collection into the cache
+        """
+        with self.preload_lock:
+            with self.lock:
+                self.bound_while_loading = {}
+            try:
+                cache = OrderedDict()
+                for doc in self.collection.find(
+                    {}, {"_id": False, "id": True, "name": True}
+                ).limit(self.cache_size):
+                    cache[doc["id"]] = doc["name"]
+            finally:
+                with self.lock:
+                    bound, self.bound_while_loading = self.bound_while_loading, None
+            with self.lock:
+                self.cache = cache
+                for id_, name in bound.items():
+                    self.put(id_, name)
+                self.loaded_at = time.monotonic()
+        logger.info("preloaded %d bindings", len(cache))
+
+    def start_refresher(self) -> threading.Thread:
+        """
+        preload, then reload the cache every refresh_interval seconds in a daemon thread
+        """
+        if self.refresh_interval is None:
+            raise ValueError("refresh_interval is not given")
 
+        def run():
+            while True:
+                time.sleep(self.refresh_interval)
+                try:
+                    self.preload()
+                except Exception as e:
+                    logger.error("failed to reload bindings. error: %s", e)
+
+        self.preload()
+        self.refresher = threading.Thread(
+            target=run, name="bind-refresher", daemon=True
+        )
+        self.refresher.start()
+        return self.refresher
+
+    @metrics.timed("bind_bind")
     def bind(self, id_: int, name: str):
         doc = {"id": id_, "name": name}
         self.collection.replace_one({"id": id_}, doc, upsert=True)
+        with self.lock:
+            self.put(id_, name)
+            if self.bound_while_loading is not None:
+                self.bound_while_loading[id_] = name
 
+    @metrics.timed("bind_find_name")
     def find_name(self, id_: int) -> Optional[str]:
-        res = self.collection.find_one({"id": id_})
-        if res is None:
-            return None
-        else:
-            return res["name"]
+        with self.lock:
+            if id_ in self.cache:
+                self.cache_hits += 1
+                self.cache.move_to_end(id_)
+                return self.cache[id_]
+            self.cache_misses += 1
+
+        res = self.collection.find_one({"id": id_}, {"_id": False, "name": True})
+        name = None if res is None else res["name"]
+        with self.lock:
+            # bind may have been called while reading
+            if id_ not in self.cache:
+                self.put(id_, name)
+        return name
+
+    def put(self, id_: int, name: Optional[str]):
+        self.cache[id_] = name
+        self.cache.move_to_end(id_)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def cache_stats(self) -> Dict[str, float]:
+        total = self.cache_hits + self.cache_misses
+        return {
+            "size": len(self.cache),
+            "hits": self.cache_hits,
+            "misses": self.cache_misses,
+            "hit_ratio": self.cache_hits / total if total > 0 else 0.0,
+        }
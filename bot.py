@@ -1,34 +1,97 @@
+import asyncio
+import contextlib
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+
 import discord
 
-import gspreads
 import parse_result
+from archive import ArchiveService
 from bind import BindService
+from dedupe import MessageDeduplicator
 from logger import logger
+from metrics import metrics
 from parse import ParseService
 from respond import RespondService
+from routing import SheetRouter
+
+# reply when a handler doesn't finish in time. the reply of it is sent when it finishes
+TIMEOUT_MESSAGE = (
+    "[error] 時間内に処理が終わりませんでした。\n"
+    "処理が終わったら結果を送ります。しばらくしてからスプレッドシートも確認してください。"
+)
+# reply when a handler raised
+ERROR_MESSAGE = "[error] 処理中にエラーが発生しました。\n" "開発者は確認してください。"
 
 
 class TurnipPriceBotService:
+    """
+    receive messages and reply to them.
+
+    RespondService blocks on MongoDB and Google Sheets, so it runs on a thread pool
+    with at most `concurrency` requests at once and `timeout` seconds for each.
+    messages from the same author are processed in the order they arrived.
+    """
+
     def __init__(
         self,
         token: str,
-        gspread_service: gspreads.GspreadService,
+        router: SheetRouter,
         bind_service: BindService,
+        concurrency: int = 8,
+        timeout: float = 30,
+        started_at: Optional[float] = None,
+        archive_service: Optional[ArchiveService] = None,
+        dedupe_size: int = 10000,
+        dedupe_ttl: float = 600,
+        view_ttl: float = 60,
     ):
-        self.respond_service = RespondService(gspread_service, bind_service)
+        self.router = router
+        self.respond_service = RespondService(
+            router, bind_service, archive_service=archive_service, view_ttl=view_ttl
+        )
         self.bot_token = token
         self.client = discord.Client()
+        # created at the first message because client.user is set on login
+        self.parse_service: Optional[ParseService] = None
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(
+            max_workers=concurrency, thread_name_prefix="respond"
+        )
+        # created on the event loop at the first message
+        self.semaphore: Optional[asyncio.Semaphore] = None
+        # author id -> (lock, number of messages holding or waiting the lock)
+        self.author_locks: Dict[int, Tuple[asyncio.Lock, int]] = {}
+        # time.perf_counter() when the process started, to log the startup time
+        self.started_at = started_at
+        # ids of processed messages, to drop ones delivered again on reconnection
+        self.deduplicator = MessageDeduplicator(dedupe_size, dedupe_ttl)
 
         @self.client.event
         async def on_ready():
-            logger.info("bot is ready")
+            if self.started_at is None:
+                logger.info("bot is ready")
+            else:
+                logger.info(
+                    "bot is ready. startup time: %.2fs",
+                    time.perf_counter() - self.started_at,
+                )
+                # on_ready is called again on reconnection
+                self.started_at = None
 
         @self.client.event
         async def on_message(message):
             await self.on_message(message)
 
     def run(self):
-        self.client.run(self.bot_token)
+        try:
+            self.client.run(self.bot_token)
+        finally:
+            self.executor.shutdown(wait=True)
+            # flush writes queued in write-behind mode
+            self.router.pool.close()
 
     async def on_message(self, message: discord.Message):
         logger.info(
@@ -37,11 +100,15 @@ class TurnipPriceBotService:
             message.id,
             message,
         )
+        if self.deduplicator.seen(message.id):
+            logger.info("duplicate message dropped. id: %s", message.id)
+            return
 
         # parse message by parse_service
-        parse_service = ParseService(self.client.user)
+        if self.parse_service is None or self.parse_service.user != self.client.user:
+            self.parse_service = ParseService(self.client.user)
         try:
-            request: parse_result.ParseResult = parse_service.recognize(message)
+            request: parse_result.ParseResult = self.parse_service.recognize(message)
         except Exception as e:
             logger.error(
                 "unknown error occurred on parser. error: %s, message id %s",
@@ -51,10 +118,92 @@ class TurnipPriceBotService:
             )
             return
 
+        if isinstance(request, parse_result.IgnorableRequest):
+            return
+
         # respond to message by self.respond_service
-        response = self.respond_service.respond_to(message, request)
-        if response is not None:
-            await message.channel.send(response)
-            logger.info(
-                "message sent. content: %s, in reply to %s", response, message.id
+        async with self.author_lock(message.author.id):
+            await self.respond(message, request)
+
+    async def respond(
+        self, message: discord.Message, request: parse_result.ParseResult
+    ):
+        """
+        run self.respond_service on the thread pool and send the reply.
+
+        a thread can't be stopped, so when the handler times out the user is told so,
+        but the semaphore and the author lock are held until the handler finishes.
+        then the next message of the author never runs with it,
+        and the late reply is sent after the timeout message.
+        """
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.concurrency)
+        loop = asyncio.get_event_loop()
+        async with self.semaphore:
+            future = loop.run_in_executor(
+                self.executor, self.respond_service.respond_to, message, request
             )
+            try:
+                # shield not to cancel the future, which doesn't stop the thread anyway
+                response = await asyncio.wait_for(asyncio.shield(future), self.timeout)
+            except asyncio.TimeoutError:
+                logger.error(
+                    "respond timed out. timeout: %s, message id: %s",
+                    self.timeout,
+                    message.id,
+                )
+                await self.send(message, TIMEOUT_MESSAGE)
+                response = await self.wait_late(message, future)
+            except Exception as e:
+                logger.error(
+                    "unknown error occurred on respond. error: %s, message id %s",
+                    e,
+                    message.id,
+                    exc_info=True,
+                )
+                response = ERROR_MESSAGE
+            if response is not None:
+                await self.send(message, response)
+
+    async def wait_late(
+        self, message: discord.Message, future: "asyncio.Future[Optional[str]]"
+    ) -> Optional[str]:
+        """
+        wait for the handler which timed out, and returns its reply
+        """
+        try:
+            response = await future
+        except Exception as e:
+            logger.error(
+                "unknown error occurred on respond after timeout. error: %s, message id %s",
+                e,
+                message.id,
+                exc_info=True,
+            )
+            return ERROR_MESSAGE
+        logger.info("respond finished after timeout. message id: %s", message.id)
+        return response
+
+    async def send(self, message: discord.Message, response: str):
+        with metrics.span("discord_send"):
+            await message.channel.send(response)
+        logger.info("message sent. content: %s, in reply to %s", response, message.id)
+
+    @contextlib.asynccontextmanager
+    async def author_lock(self, author_id: int):
+        """
+        serialize messages from the same author
+        """
+        lock, count = self.author_locks.get(author_id, (None, 0))
+        if lock is None:
+            lock = asyncio.Lock()
+        self.author_locks[author_id] = (lock, count + 1)
+        try:
+            async with lock:
+                yield
+        finally:
+            lock, count = self.author_locks[author_id]
+            if count == 1:
+                del self.author_locks[author_id]
+            else:
+                self.author_locks[author_id] = (lock, count - 1)
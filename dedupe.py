@@ -0,0 +1,59 @@
+import collections
+import time
+from typing import Callable, Deque, Set, Tuple
+
+from metrics import MetricsRegistry, metrics
+
+
+class MessageDeduplicator:
+    """
+    ids of the messages processed in the last ttl seconds, at most size of them.
+
+    the gateway may deliver the same message again after a reconnection,
+    and processing it twice writes the sheet and replies twice.
+    the ids are kept in a ring buffer in arrival order with a set for lookups,
+    so the memory is bounded by size. it is used on the event loop only.
+    """
+
+    def __init__(
+        self,
+        size: int = 10000,
+        ttl: float = 600,
+        registry: MetricsRegistry = metrics,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        if size <= 0:
+            raise ValueError("size must be positive")
+        self.size = size
+        self.ttl = ttl
+        self.clock = clock
+        # (time first seen, message id), oldest first
+        self.order: Deque[Tuple[float, int]] = collections.deque()
+        self.ids: Set[int] = set()
+        # number of messages dropped as duplicates
+        self.dropped = 0
+        registry.gauge("turnip_duplicate_messages_dropped", lambda: self.dropped)
+
+    def seen(self, message_id: int) -> bool:
+        """
+        returns true if message_id was already seen, otherwise remembers it
+        """
+        now = self.clock()
+        self.expire(now)
+        if message_id in self.ids:
+            self.dropped += 1
+            return True
+        if len(self.order) >= self.size:
+            _, oldest = self.order.popleft()
+            self.ids.discard(oldest)
+        self.order.append((now, message_id))
+        self.ids.add(message_id)
+        return False
+
+    def expire(self, now: float):
+        while self.order and now - self.order[0][0] >= self.ttl:
+            _, message_id = self.order.popleft()
+            self.ids.discard(message_id)
+
+    def __len__(self) -> int:
+        return len(self.order)
@@ -1,26 +1,699 @@
-from typing import List
+import datetime
+import math
+import random
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
 
 import gspread
-from oauth2client.service_account import ServiceAccountCredentials
+from google.auth.transport.requests import Request
 
-# TODO: たまに再認証が必要?
+from logger import logger
+from metrics import metrics
+from ratelimit import READ, WRITE, RateLimiter
+from snapshot_store import SnapshotStore
+
+SCOPE = [
+    "https://spreadsheets.google.com/feeds",
+    "https://www.googleapis.com/auth/drive",
+]
+
+
+class GspreadClient:
+    """
+    gspread client authorized once with the service account credential
+    and shared by all spreadsheets.
+
+    gspread converts the credential to google-auth credentials used by the session
+    of the client. the access token expires in an hour. start_refresher refreshes it
+    in the background refresh_margin seconds before it expires,
+    and GspreadService calls refresh when a request is rejected with 401 anyway.
+    """
+
+    def __init__(self, credential: dict, refresh_margin: float = 300):
+        self.credential = credential
+        self.refresh_margin = refresh_margin
+        self.client: Optional[gspread.Client] = None
+        # incremented on every refresh
+        self.generation = 0
+        self.lock = threading.Lock()
+        self.refresher: Optional[threading.Thread] = None
+
+    def authorize(self) -> gspread.Client:
+        with self.lock:
+            if self.client is None:
+                self.client = gspread.authorize(self.credentials())
+            return self.client
+
+    def credentials(self):
+        # oauth2client is slow to import and only the google backend needs it
+        from oauth2client.service_account import ServiceAccountCredentials
+
+        return ServiceAccountCredentials.from_json_keyfile_dict(self.credential, SCOPE)
+
+    @property
+    def expires_at(self) -> Optional[float]:
+        """
+        monotonic time when the token expires, None before the first token
+        """
+        if self.client is None:
+            return None
+        return token_expires_at(self.client.session.credentials)
+
+    @metrics.timed("gspread_refresh")
+    def refresh(self, generation: Optional[int] = None):
+        """
+        get a new access token. the credentials of the session are refreshed in place,
+        so worksheets opened by this client keep working.
+        if generation is given and another thread has refreshed since then, do nothing.
+        """
+        client = self.authorize()
+        with self.lock:
+            if generation is not None and generation != self.generation:
+                return
+            client.session.credentials.refresh(Request())
+            self.generation += 1
+        logger.info("refreshed the access token of gspread")
+
+    def start_refresher(self) -> threading.Thread:
+        """
+        refresh the token before it expires in a daemon thread
+        """
+
+        def run():
+            while True:
+                # no token yet, get one now
+                expires_at = self.expires_at
+                if expires_at is not None:
+                    wait = expires_at - self.refresh_margin - time.monotonic()
+                    if wait > 0:
+                        time.sleep(wait)
+                try:
+                    self.refresh()
+                except Exception as e:
+                    logger.error("failed to refresh the access token. error: %s", e)
+                    time.sleep(30)
+
+        self.authorize()
+        self.refresher = threading.Thread(
+            target=run, name="gspread-refresher", daemon=True
+        )
+        self.refresher.start()
+        return self.refresher
+
+    def open_worksheets(self, key: str) -> List[gspread.Worksheet]:
+        """
+        open the spreadsheet by key and list its worksheets
+        """
+        spreadsheet = self.authorize().open_by_key(key)
+        return spreadsheet.worksheets()
+
+
+def token_expires_at(credentials) -> Optional[float]:
+    """
+    monotonic time when the token of google-auth credentials expires
+    """
+    # naive datetime in UTC
+    expiry = getattr(credentials, "expiry", None)
+    if expiry is None:
+        return None
+    left = (expiry - datetime.datetime.utcnow()).total_seconds()
+    return time.monotonic() + left
+
+
+def api_status(error: Exception) -> Optional[int]:
+    """
+    HTTP status code of gspread.exceptions.APIError
+    """
+    response = getattr(error, "response", None)
+    return getattr(response, "status_code", None)
 
 
 class GspreadService:
-    def __init__(self, name: str, credential: str):
-        scope = [
-            "https://spreadsheets.google.com/feeds",
-            "https://www.googleapis.com/auth/drive",
+    """
+    thin wrapper of gspread worksheets.
+    worksheets are gspread.Worksheet or anything with the same methods
+    such as localsheet.LocalWorksheet. if worksheets is None,
+    they are opened by opener at the first request.
+
+    if client is given, a request rejected with 401 is retried once
+    after client refreshed the token.
+    requests wait for limiter if given, and 429 and 5xx are retried
+    at most retries times with jittered exponential backoff.
+    if retry_budget is given, a request is not retried when the next retry
+    would start more than retry_budget seconds after the request.
+
+    get_table keeps a snapshot of each worksheet in memory for cache_ttl seconds.
+    update_cell patches the snapshot in place after the write succeeded,
+    so the snapshot stays consistent with what this process has written.
+    the returned table is shared, callers must not modify it.
+
+    if store is given, the last fetched snapshots are saved to it under key.
+    the saved snapshots are loaded in __init__ and served until they are
+    reconciled with the live worksheet in the background,
+    and the last snapshot is served when fetching the worksheet failed.
+    callers locating cells to write pass live=True, so that they never get
+    a snapshot loaded from the store, whose layout may be out of date.
+    """
+
+    def __init__(
+        self,
+        worksheets: Optional[List[gspread.Worksheet]],
+        cache_ttl: float = 0,
+        write_behind: bool = False,
+        write_batch_size: int = 50,
+        write_interval: float = 1.0,
+        client: Optional[GspreadClient] = None,
+        limiter: Optional[RateLimiter] = None,
+        retries: int = 3,
+        backoff: float = 0.5,
+        backoff_max: float = 32,
+        retry_budget: Optional[float] = None,
+        opener: Optional[Callable[[], List[gspread.Worksheet]]] = None,
+        key: str = "",
+        store: Optional[SnapshotStore] = None,
+    ):
+        self.worksheets = worksheets
+        self.opener = opener
+        self.open_lock = threading.Lock()
+        self.key = key
+        self.store = store
+        self.client = client
+        self.limiter = limiter
+        self.retries = retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.retry_budget = retry_budget
+
+        self.cache_ttl = cache_ttl
+        # sheet index -> (fetched time, table). fetched time is None
+        # for snapshots loaded from the store and not reconciled yet
+        self.snapshots: Dict[int, Tuple[Optional[float], List[List[str]]]] = {}
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.lock = threading.Lock()
+        # sheet indexes being reconciled
+        self.reconciling: Set[int] = set()
+        # sheet index -> number of fetches in flight
+        self.fetching: Dict[int, int] = {}
+        # sheet index -> cells (patched time, row, column, value) written while fetching,
+        # applied to the fetched table if written after the fetch started
+        self.patches: Dict[int, List[Tuple[float, int, int, Any]]] = {}
+        if store is not None:
+            for sheet, stored in store.load(key).items():
+                logger.info(
+                    "loaded the snapshot of sheet %d of %s. version: %d, saved at: %s",
+                    sheet,
+                    key,
+                    stored.version,
+                    datetime.datetime.fromtimestamp(stored.saved_at),
+                )
+                self.snapshots[sheet] = (None, stored.table)
+
+        self.write_queue: Optional[WriteBehindQueue] = None
+        if write_behind:
+            self.write_queue = WriteBehindQueue(
+                self.write_cells, write_batch_size, write_interval
+            )
+
+    def worksheet(self, sheet: int) -> gspread.Worksheet:
+        if self.worksheets is None:
+            with self.open_lock:
+                if self.worksheets is None:
+                    logger.info("open spreadsheet %s", self.key)
+                    self.worksheets = self.opener()
+        return self.worksheets[sheet]
+
+    @metrics.timed("gspread_update_cell")
+    def update_cell(self, sheet: int, row: int, column: int, value):
+        """
+        write a cell. in write-behind mode, the cell is queued and this blocks
+        until the batch containing it is acknowledged.
+        """
+        if self.write_queue is not None:
+            return self.write_queue.put(sheet, row, column, value).result()
+        res = self.call(WRITE, self.worksheet(sheet).update_cell, row, column, value)
+        self.patch_snapshot(sheet, row, column, value)
+        return res
+
+    @metrics.timed("gspread_update_cells")
+    def update_cells(self, sheet: int, cells: List[Tuple[int, int, Any]]):
+        """
+        write cells [(row, column, value)] by one request.
+        in write-behind mode, this blocks until all of them are acknowledged.
+        """
+        if self.write_queue is not None:
+            futures = [
+                self.write_queue.put(sheet, row, column, value)
+                for row, column, value in cells
+            ]
+            return [future.result() for future in futures]
+        return self.write_cells(sheet, cells)
+
+    def write_cells(self, sheet: int, cells: List[Tuple[int, int, Any]]):
+        """
+        write cells [(row, column, value)] by one batch_update request.
+        adjacent cells in a row are written as one range.
+        """
+        data = []
+        for row, column, values in cell_ranges(cells):
+            first = gspread.utils.rowcol_to_a1(row, column)
+            if len(values) == 1:
+                range_ = first
+            else:
+                last = gspread.utils.rowcol_to_a1(row, column + len(values) - 1)
+                range_ = "{}:{}".format(first, last)
+            data.append({"range": range_, "values": [values]})
+        res = self.call(
+            WRITE,
+            self.worksheet(sheet).batch_update,
+            data,
+            value_input_option="USER_ENTERED",
+        )
+        for row, column, value in cells:
+            self.patch_snapshot(sheet, row, column, value)
+        return res
+
+    def call(self, kind: str, function: Callable, *args, **kwargs):
+        """
+        call the worksheet method of kind (READ or WRITE)
+        """
+        generation = self.client.generation if self.client is not None else None
+        start = time.monotonic()
+        attempt = 0
+        refreshed = False
+        while True:
+            if self.limiter is not None:
+                self.limiter.acquire(kind)
+            try:
+                return function(*args, **kwargs)
+            except gspread.exceptions.APIError as e:
+                status = api_status(e)
+                if status == 401 and self.client is not None and not refreshed:
+                    logger.warning(
+                        "gspread request unauthorized, refresh the token. error: %s", e
+                    )
+                    self.client.refresh(generation)
+                    refreshed = True
+                    continue
+                if (status == 429 or (status or 0) >= 500) and attempt < self.retries:
+                    delay = random.uniform(
+                        0, min(self.backoff_max, self.backoff * 2**attempt)
+                    )
+                    elapsed = time.monotonic() - start
+                    if (
+                        self.retry_budget is not None
+                        and elapsed + delay > self.retry_budget
+                    ):
+                        logger.warning(
+                            "gspread request failed, give up retrying after %.2fs. "
+                            "error: %s",
+                            elapsed,
+                            e,
+                        )
+                        raise
+                    attempt += 1
+                    logger.warning(
+                        "gspread request failed, retry in %.2fs (%d/%d). error: %s",
+                        delay,
+                        attempt,
+                        self.retries,
+                        e,
+                    )
+                    metrics.histogram(
+                        "turnip_gspread_backoff_seconds", {"status": str(status)}
+                    ).observe(delay)
+                    time.sleep(delay)
+                    continue
+                raise
+
+    def close(self):
+        """
+        flush queued writes and save the snapshots with them
+        """
+        if self.write_queue is not None:
+            self.write_queue.close()
+        if self.store is not None:
+            with self.lock:
+                snapshots = list(self.snapshots.items())
+            for sheet, (_, table) in snapshots:
+                self.store.save_async(self.key, sheet, table)
+
+    @metrics.timed("gspread_get_table")
+    def get_table(self, sheet: int, live: bool = False) -> List[List[str]]:
+        """
+        the whole worksheet. if live, a snapshot loaded from the store
+        and not reconciled yet is not served, and the worksheet is fetched instead.
+        """
+        with self.lock:
+            snapshot = self.cached_snapshot(sheet, live)
+            if snapshot is not None:
+                self.cache_hits += 1
+                return snapshot
+            self.cache_misses += 1
+            stale = self.snapshots.get(sheet)
+
+        try:
+            return self.fetch(sheet)
+        except Exception as e:
+            if stale is None or self.store is None or (live and stale[0] is None):
+                raise
+            logger.warning(
+                "failed to fetch sheet %d of %s, use the last snapshot. error: %s",
+                sheet,
+                self.key,
+                e,
+            )
+            return stale[1]
+
+    def fetch(self, sheet: int) -> List[List[str]]:
+        """
+        get the whole worksheet and keep it as the snapshot.
+        cells written while reading may be missing in the response,
+        so they are applied to the table again.
+        """
+        with self.lock:
+            self.fetching[sheet] = self.fetching.get(sheet, 0) + 1
+        try:
+            fetched_at = time.monotonic()
+            table = self.call(READ, self.worksheet(sheet).get_all_values)
+        finally:
+            with self.lock:
+                patches = [
+                    patch
+                    for patch in self.patches.get(sheet, [])
+                    if patch[0] >= fetched_at
+                ]
+                self.fetching[sheet] -= 1
+                if self.fetching[sheet] == 0:
+                    del self.fetching[sheet]
+                    self.patches.pop(sheet, None)
+        for _, row, column, value in patches:
+            while len(table) < row:
+                table.append([])
+            write_cell(table, row, column, value)
+        if self.cache_ttl > 0 or self.store is not None:
+            with self.lock:
+                self.snapshots[sheet] = (fetched_at, table)
+        if self.store is not None:
+            self.store.save_async(self.key, sheet, table)
+        return table
+
+    def cached_snapshot(
+        self, sheet: int, live: bool = False
+    ) -> Optional[List[List[str]]]:
+        """
+        the table of the snapshot if it can be served. call with self.lock held.
+        a snapshot loaded from the store is served while it is reconciled unless live.
+        """
+        snapshot = self.snapshots.get(sheet)
+        if snapshot is None:
+            return None
+        fetched_at, table = snapshot
+        if fetched_at is None:
+            if live:
+                return None
+            self.reconcile(sheet)
+            return table
+        if time.monotonic() - fetched_at < self.cache_ttl:
+            return table
+        return None
+
+    def reconcile(self, sheet: int):
+        """
+        replace the snapshot loaded from the store with the live worksheet
+        in the background. call with self.lock held.
+        """
+        if sheet in self.reconciling:
+            return
+        self.reconciling.add(sheet)
+
+        def run():
+            try:
+                self.fetch(sheet)
+                logger.info("reconciled sheet %d of %s", sheet, self.key)
+            except Exception as e:
+                logger.warning(
+                    "failed to reconcile sheet %d of %s. error: %s", sheet, self.key, e
+                )
+            finally:
+                with self.lock:
+                    self.reconciling.discard(sheet)
+
+        threading.Thread(target=run, name="gspread-reconcile", daemon=True).start()
+
+    @metrics.timed("gspread_get_ranges")
+    def get_ranges(
+        self, sheet: int, ranges: List[Tuple[int, int, int, int]], live: bool = False
+    ) -> List[List[List[str]]]:
+        """
+        values of ranges [(top, left, bottom, right)], one-origin and inclusive,
+        by one batch_get request. the values are padded with "" to the size of each range.
+        they are sliced from the snapshot while it is fresh.
+        live is the same as get_table.
+        """
+        with self.lock:
+            table = self.cached_snapshot(sheet, live)
+            if table is not None:
+                self.cache_hits += 1
+                return slice_ranges(table, ranges)
+            self.cache_misses += 1
+            stale = self.snapshots.get(sheet)
+
+        names = [
+            "{}:{}".format(
+                gspread.utils.rowcol_to_a1(top, left),
+                gspread.utils.rowcol_to_a1(bottom, right),
+            )
+            for top, left, bottom, right in ranges
+        ]
+        try:
+            values = self.call(READ, self.worksheet(sheet).batch_get, names)
+        except Exception as e:
+            if stale is None or self.store is None or (live and stale[0] is None):
+                raise
+            logger.warning(
+                "failed to get ranges of sheet %d of %s, use the last snapshot. error: %s",
+                sheet,
+                self.key,
+                e,
+            )
+            return slice_ranges(stale[1], ranges)
+        return [
+            pad([list(row) for row in range_values], bottom - top + 1, right - left + 1)
+            for range_values, (top, left, bottom, right) in zip(values, ranges)
         ]
-        credentials = ServiceAccountCredentials.from_json_keyfile_dict(
-            credential, scope
+
+    def is_restored(self, sheet: int, table: List[List[str]]) -> bool:
+        """
+        whether table is the snapshot loaded from the store and not reconciled yet
+        """
+        with self.lock:
+            snapshot = self.snapshots.get(sheet)
+            return snapshot is not None and snapshot[0] is None and snapshot[1] is table
+
+    def invalidate(self, sheet: Optional[int] = None):
+        """
+        drop the snapshot of the sheet, or all snapshots if sheet is None
+        """
+        with self.lock:
+            if sheet is None:
+                self.snapshots.clear()
+            else:
+                self.snapshots.pop(sheet, None)
+
+    def expire(self, sheet: int):
+        """
+        fetch the worksheet again on the next read. unlike invalidate,
+        the table is kept and served if fetching it failed.
+        a snapshot loaded from the store is left to be reconciled.
+        """
+        with self.lock:
+            snapshot = self.snapshots.get(sheet)
+            if snapshot is not None and snapshot[0] is not None:
+                self.snapshots[sheet] = (-math.inf, snapshot[1])
+
+    def patch_snapshot(self, sheet: int, row: int, column: int, value):
+        """
+        reflect a written cell to the snapshot. row and column are one-origin like gspread.
+        """
+        with self.lock:
+            if sheet in self.fetching:
+                self.patches.setdefault(sheet, []).append(
+                    (time.monotonic(), row, column, value)
+                )
+            snapshot = self.snapshots.get(sheet)
+            if snapshot is None:
+                return
+            table = snapshot[1]
+            if row > len(table):
+                # the row is out of the snapshot, fetch it again next time
+                self.snapshots.pop(sheet)
+                return
+            write_cell(table, row, column, value)
+
+    def cache_stats(self) -> Dict[str, float]:
+        total = self.cache_hits + self.cache_misses
+        return {
+            "hits": self.cache_hits,
+            "misses": self.cache_misses,
+            "hit_ratio": self.cache_hits / total if total > 0 else 0.0,
+        }
+
+
+def write_cell(table: List[List[str]], row: int, column: int, value):
+    """
+    set a cell of the table, one-origin like gspread
+    """
+    cells = table[row - 1]
+    if len(cells) < column:
+        cells.extend([""] * (column - len(cells)))
+    cells[column - 1] = str(value)
+
+
+def slice_ranges(
+    table: List[List[str]], ranges: List[Tuple[int, int, int, int]]
+) -> List[List[List[str]]]:
+    """
+    values of ranges [(top, left, bottom, right)] of the table like get_ranges
+    """
+    return [
+        pad(
+            [row[left - 1 : right] for row in table[top - 1 : bottom]],
+            bottom - top + 1,
+            right - left + 1,
         )
-        client = gspread.authorize(credentials)
-        spreadsheet = client.open_by_key(name)
-        self.worksheets = spreadsheet.worksheets()
+        for top, left, bottom, right in ranges
+    ]
 
-    def update_cell(self, sheet: int, row: int, column: int, value):
-        return self.worksheets[sheet].update_cell(row, column, value)
 
-    def get_table(self, sheet: int) -> List[List[str]]:
-        return self.worksheets[sheet].get_all_values()
+def pad(values: List[List[str]], height: int, width: int) -> List[List[str]]:
+    """
+    pad rows and cells trimmed by the API with ""
+    """
+    values = [row + [""] * (width - len(row)) for row in values]
+    return values + [[""] * width for _ in range(height - len(values))]
+
+
+def cell_ranges(cells: List[Tuple[int, int, Any]]) -> List[Tuple[int, int, List[Any]]]:
+    """
+    merge cells [(row, column, value)] into ranges [(row, first column, values)]
+    """
+    ranges: List[Tuple[int, int, List[Any]]] = []
+    for row, column, value in sorted(cells, key=lambda cell: cell[:2]):
+        if ranges:
+            last_row, last_column, values = ranges[-1]
+            if last_row == row and last_column + len(values) == column:
+                values.append(value)
+                continue
+        ranges.append((row, column, [value]))
+    return ranges
+
+
+class WriteBehindQueue:
+    """
+    collect cell writes and flush them per sheet by one request.
+
+    writes are keyed by (sheet, row, column) and a later write to the same cell wins.
+    the queue is flushed when it holds batch_size cells
+    or interval seconds passed since the oldest queued write.
+    """
+
+    def __init__(
+        self,
+        write: Callable[[int, List[Tuple[int, int, Any]]], Any],
+        batch_size: int,
+        interval: float,
+    ):
+        self.write = write
+        self.batch_size = batch_size
+        self.interval = interval
+        # (sheet, row, column) -> (value, futures waiting for the cell)
+        self.pending: Dict[Tuple[int, int, int], Tuple[Any, List[Future]]] = {}
+        self.oldest: Optional[float] = None
+        self.closed = False
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(
+            target=self.run, name="gspread-write-behind", daemon=True
+        )
+        self.thread.start()
+
+    def put(self, sheet: int, row: int, column: int, value) -> Future:
+        future = Future()
+        with self.condition:
+            if self.closed:
+                raise RuntimeError("write-behind queue is closed")
+            key = (sheet, row, column)
+            _, futures = self.pending.get(key, (None, []))
+            futures.append(future)
+            self.pending[key] = (value, futures)
+            if self.oldest is None:
+                self.oldest = time.monotonic()
+            self.condition.notify()
+        return future
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.closed and not self.is_due():
+                    if self.oldest is None:
+                        self.condition.wait()
+                    else:
+                        self.condition.wait(
+                            self.oldest + self.interval - time.monotonic()
+                        )
+                batch = self.take()
+                closed = self.closed
+            self.flush_batch(batch)
+            if closed:
+                return
+
+    def is_due(self) -> bool:
+        if self.oldest is None:
+            return False
+        return (
+            len(self.pending) >= self.batch_size
+            or time.monotonic() - self.oldest >= self.interval
+        )
+
+    def take(self) -> Dict[Tuple[int, int, int], Tuple[Any, List[Future]]]:
+        batch = self.pending
+        self.pending = {}
+        self.oldest = None
+        return batch
+
+    def flush_batch(self, batch: Dict[Tuple[int, int, int], Tuple[Any, List[Future]]]):
+        sheets: Dict[int, List[Tuple[int, int, int]]] = {}
+        for key in batch:
+            sheets.setdefault(key[0], []).append(key)
+        for sheet, keys in sheets.items():
+            cells = [
+                (row, column, batch[(sheet, row, column)][0]) for _, row, column in keys
+            ]
+            try:
+                res = self.write(sheet, cells)
+            except Exception as e:
+                logger.error(
+                    "failed to flush %d cells of sheet %d. error: %s",
+                    len(cells),
+                    sheet,
+                    e,
+                )
+                for key in keys:
+                    for future in batch[key][1]:
+                        future.set_exception(e)
+                continue
+            logger.info("flushed %d cells of sheet %d", len(cells), sheet)
+            for key in keys:
+                for future in batch[key][1]:
+                    future.set_result(res)
+
+    def close(self):
+        """
+        flush all queued writes and stop the flusher thread
+        """
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.thread.join()
@@ -0,0 +1,103 @@
+import bisect
+from typing import List, Set, Tuple
+
+from price_matrix import MISSING, PriceMatrix
+from table import TERMS_LENGTH
+
+
+class Leaderboard:
+    """
+    members sorted by the price and by the ratio against their buy price for each sell term.
+
+    the rankings are sorted lists of (-value, member index), built once from PriceMatrix
+    and updated by update as cells change, so top is O(count) without a scan.
+    members with a blank name are not ranked, and of members with the same name
+    only the first one is ranked.
+    it is not thread safe, TurnipPriceTableViewService.lock guards it.
+    """
+
+    def __init__(self, matrix: PriceMatrix):
+        self.matrix = matrix
+        self.members: Set[int] = {
+            index for name, index in matrix.indexes.items() if name.strip() != ""
+        }
+        prices = matrix.prices.tolist()
+        # term (1 for 月AM, ..., 12 for 土PM) -> ranking. index 0 is unused
+        self.by_price: List[List[Tuple[float, int]]] = [[]]
+        self.by_ratio: List[List[Tuple[float, int]]] = [[]]
+        for term in range(1, TERMS_LENGTH):
+            by_price, by_ratio = [], []
+            for index in self.members:
+                buy, price = prices[index][0], prices[index][term]
+                if price != MISSING:
+                    by_price.append((-price, index))
+                    if buy not in (MISSING, 0):
+                        by_ratio.append((-price / buy, index))
+            by_price.sort()
+            by_ratio.sort()
+            self.by_price.append(by_price)
+            self.by_ratio.append(by_ratio)
+
+    def update(self, index: int, term: int, old: int):
+        """
+        reflect the change of the cell (member index, term) from old
+        to the current value in the matrix
+        """
+        if index not in self.members:
+            return
+        row = self.matrix.prices[index]
+        new = int(row[term])
+        if term == 0:
+            # every ratio of the member changes
+            for sell_term in range(1, TERMS_LENGTH):
+                price = int(row[sell_term])
+                remove(self.by_ratio[sell_term], ratio_key(price, old, index))
+                insert(self.by_ratio[sell_term], ratio_key(price, new, index))
+            return
+        buy = int(row[0])
+        remove(self.by_price[term], price_key(old, index))
+        remove(self.by_ratio[term], ratio_key(old, buy, index))
+        insert(self.by_price[term], price_key(new, index))
+        insert(self.by_ratio[term], ratio_key(new, buy, index))
+
+    def top(
+        self, term: int, count: int
+    ) -> Tuple[List[Tuple[str, int]], List[Tuple[str, int, float]]]:
+        """
+        returns ([(name, price)], [(name, price, ratio)]) of the top count members
+        """
+        names = self.matrix.names
+        prices = self.matrix.prices
+        by_price = [
+            (names[index], -int(key)) for key, index in self.by_price[term][:count]
+        ]
+        by_ratio = [
+            (names[index], int(prices[index, term]), -key)
+            for key, index in self.by_ratio[term][:count]
+        ]
+        return by_price, by_ratio
+
+
+def price_key(price: int, index: int):
+    if price == MISSING:
+        return None
+    return (-price, index)
+
+
+def ratio_key(price: int, buy: int, index: int):
+    if price == MISSING or buy in (MISSING, 0):
+        return None
+    return (-price / buy, index)
+
+
+def insert(ranking: List[Tuple[float, int]], key):
+    if key is not None:
+        bisect.insort(ranking, key)
+
+
+def remove(ranking: List[Tuple[float, int]], key):
+    if key is None:
+        return
+    i = bisect.bisect_left(ranking, key)
+    if i < len(ranking) and ranking[i] == key:
+        del ranking[i]
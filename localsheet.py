@@ -0,0 +1,164 @@
+import collections
+import copy
+import csv
+import json
+import random
+import threading
+import time
+from typing import Deque, List, Optional, Tuple
+
+import gspread
+
+
+class QuotaExceededResponse:
+    """
+    the response passed to gspread.exceptions.APIError for an injected error
+    """
+
+    def __init__(self, status_code: int, message: str):
+        self.status_code = status_code
+        self.error = {"code": status_code, "message": message, "status": "LOCAL"}
+        self.text = json.dumps({"error": self.error})
+
+    def json(self):
+        return {"error": self.error}
+
+
+class LocalWorksheet:
+    """
+    in-memory worksheet which has the methods of gspread.Worksheet used by GspreadService.
+    it loads a TSV like testdata.tsv, and saves writes to it if persist is true.
+
+    every call sleeps latency + uniform(0, jitter) seconds, and raises APIError 429
+    with probability error_rate or when more than read_quota reads or write_quota writes
+    are made in a minute, like the Sheets API.
+    """
+
+    def __init__(
+        self,
+        rows: List[List[str]],
+        path: Optional[str] = None,
+        persist: bool = False,
+        latency: float = 0,
+        jitter: float = 0,
+        error_rate: float = 0,
+        read_quota: Optional[int] = None,
+        write_quota: Optional[int] = None,
+        title: str = "local",
+    ):
+        self.rows = rows
+        self.path = path
+        self.persist = persist
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.read_quota = read_quota
+        self.write_quota = write_quota
+        self.title = title
+        # times of the calls in the last minute
+        self.reads: Deque[float] = collections.deque()
+        self.writes: Deque[float] = collections.deque()
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_tsv(cls, path: str, **kwargs) -> "LocalWorksheet":
+        with open(path, mode="r", newline="", encoding="utf-8") as f:
+            rows = [row for row in csv.reader(f, delimiter="\t")]
+        return cls(rows, path=path, **kwargs)
+
+    def save(self):
+        with self.lock:
+            rows = copy.deepcopy(self.rows)
+        with open(self.path, mode="w", newline="", encoding="utf-8") as f:
+            csv.writer(f, delimiter="\t", lineterminator="\n").writerows(rows)
+
+    def get_all_values(self) -> List[List[str]]:
+        self.simulate(self.reads, self.read_quota)
+        with self.lock:
+            return copy.deepcopy(self.rows)
+
+    def get(self, range_name: str) -> List[List[str]]:
+        return self.batch_get([range_name])[0]
+
+    def batch_get(self, ranges: List[str]) -> List[List[List[str]]]:
+        """
+        values of each A1 range. trailing empty rows and cells are removed like the API
+        """
+        self.simulate(self.reads, self.read_quota)
+        res = []
+        with self.lock:
+            for range_name in ranges:
+                (top, left), (bottom, right) = parse_range(range_name)
+                values = []
+                for row in self.rows[top - 1 : bottom]:
+                    cells = row[left - 1 : right]
+                    while cells and cells[-1] == "":
+                        cells.pop()
+                    values.append(cells)
+                while values and not values[-1]:
+                    values.pop()
+                res.append(values)
+        return res
+
+    def update_cell(self, row: int, col: int, value):
+        self.simulate(self.writes, self.write_quota)
+        with self.lock:
+            self.write(row, col, [[value]])
+        self.save_if_persist()
+
+    def update(self, range_name: str, values: List[List], **kwargs):
+        self.simulate(self.writes, self.write_quota)
+        (top, left), _ = parse_range(range_name)
+        with self.lock:
+            self.write(top, left, values)
+        self.save_if_persist()
+
+    def batch_update(self, data: List[dict], **kwargs):
+        self.simulate(self.writes, self.write_quota)
+        with self.lock:
+            for entry in data:
+                (top, left), _ = parse_range(entry["range"])
+                self.write(top, left, entry["values"])
+        self.save_if_persist()
+
+    def write(self, top: int, left: int, values: List[List]):
+        for i, cells in enumerate(values):
+            while len(self.rows) < top + i:
+                self.rows.append([])
+            row = self.rows[top + i - 1]
+            for j, value in enumerate(cells):
+                column = left + j
+                if len(row) < column:
+                    row.extend([""] * (column - len(row)))
+                row[column - 1] = "" if value is None else str(value)
+
+    def save_if_persist(self):
+        if self.persist and self.path is not None:
+            self.save()
+
+    def simulate(self, calls: Deque[float], quota: Optional[int]):
+        time.sleep(self.latency + random.uniform(0, self.jitter))
+        now = time.monotonic()
+        with self.lock:
+            while calls and now - calls[0] >= 60:
+                calls.popleft()
+            if quota is not None and len(calls) >= quota:
+                raise gspread.exceptions.APIError(
+                    QuotaExceededResponse(429, "quota exceeded (local)")
+                )
+            calls.append(now)
+        if random.random() < self.error_rate:
+            raise gspread.exceptions.APIError(
+                QuotaExceededResponse(429, "injected error (local)")
+            )
+
+
+def parse_range(range_name: str) -> Tuple[Tuple[int, int], Tuple[int, int]]:
+    """
+    "A1", "B2:D2" or "'sheet'!B2:D2" to ((top, left), (bottom, right)), one-origin
+    """
+    range_name = range_name.split("!")[-1]
+    first, _, last = range_name.partition(":")
+    top_left = gspread.utils.a1_to_rowcol(first)
+    bottom_right = gspread.utils.a1_to_rowcol(last) if last else top_left
+    return top_left, bottom_right
@@ -1,16 +1,23 @@
 import base64
 import json
 import os
+import time
 import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
 from optparse import OptionParser
 import pprint
+from typing import Callable, Optional
 
 import yaml
 
 import gspreads
+from archive import ArchiveService
 from bind import BindService
 from bot import TurnipPriceBotService
 from logger import logger
+from metrics import metrics
+from ratelimit import RateLimiter
+from routing import Route, SheetRouter, SpreadsheetPool
 
 
 def load_config():
@@ -34,15 +41,97 @@ def load_config():
     return config
 
 
+def warm_up(name: str, function: Callable[[], None], started_at: float):
+    """
+    run function to prepare the backend and log the time since the startup
+    """
+    try:
+        function()
+    except Exception as e:
+        logger.error("failed to warm up %s. error: %s", name, e, exc_info=True)
+        return
+    logger.info(
+        "%s is ready. startup time: %.2fs", name, time.perf_counter() - started_at
+    )
+
+
+def warm_up_gspread(client: Optional[gspreads.GspreadClient], router: SheetRouter):
+    """
+    authorize, open the spreadsheets of the routes and fetch their worksheets
+    """
+    if client is not None:
+        client.start_refresher()
+    for route in router.routes():
+        router.service(route).get_table(route.sheet)
+
+
 def main():
+    started_at = time.perf_counter()
     config = load_config()
     logger.info(pprint.pformat(config))
 
     # gspread
-    json_ = base64.b64decode(config["gspread_credential_base64"])
-    credential = json.loads(json_)
-
-    gspread_service = gspreads.GspreadService(config["gspread_name"], credential)
+    if config.get("gspread_backend") == "local":
+        logger.info("use local worksheets")
+        import localsheet
+
+        # spreadsheet keys are paths of TSV
+        def opener(path):
+            return [
+                localsheet.LocalWorksheet.from_tsv(
+                    path,
+                    persist=config.get("gspread_local_persist") or False,
+                    latency=config.get("gspread_local_latency") or 0,
+                    jitter=config.get("gspread_local_jitter") or 0,
+                    error_rate=config.get("gspread_local_error_rate") or 0,
+                    read_quota=config.get("gspread_local_read_quota"),
+                    write_quota=config.get("gspread_local_write_quota"),
+                )
+            ]
+
+        default_key = config.get("gspread_local_path")
+        client = None
+    else:
+        json_ = base64.b64decode(config["gspread_credential_base64"])
+        credential = json.loads(json_)
+        client = gspreads.GspreadClient(
+            credential, refresh_margin=config.get("gspread_refresh_margin") or 300
+        )
+        opener = client.open_worksheets
+        default_key = config.get("gspread_name")
+
+    respond_timeout = config.get("respond_timeout") or 30
+    limiter = RateLimiter(
+        read_per_minute=config.get("gspread_read_per_minute"),
+        write_per_minute=config.get("gspread_write_per_minute"),
+        burst=config.get("gspread_burst") or 10,
+    )
+    store = None
+    if config.get("gspread_snapshot_path"):
+        from snapshot_store import SnapshotStore
+
+        store = SnapshotStore(config["gspread_snapshot_path"])
+    pool = SpreadsheetPool(
+        opener,
+        cache_ttl=config.get("gspread_cache_ttl") or 0,
+        write_behind=config.get("gspread_write_behind") or False,
+        write_batch_size=config.get("gspread_write_batch_size") or 50,
+        write_interval=config.get("gspread_write_interval") or 1.0,
+        client=client,
+        limiter=limiter,
+        retries=config.get("gspread_retries", 3),
+        backoff=config.get("gspread_backoff") or 0.5,
+        backoff_max=config.get("gspread_backoff_max") or 32,
+        # a handler reads and then writes, so each request retries at most
+        # for half of the respond timeout not to write after the user is told it timed out
+        retry_budget=respond_timeout / 2,
+        store=store,
+    )
+    router = SheetRouter.from_config(
+        pool,
+        config.get("routes") or [],
+        Route(default_key) if default_key else None,
+    )
 
     # mongodb
     if config.get("mongodb_use_inmemory") or False:
@@ -66,12 +155,72 @@ def main():
     collection = mongodb[config["mongo_database"]][config["mongo_collection"]]
 
     # bind
-    bind_service = BindService(collection)
+    bind_service = BindService(
+        collection,
+        cache_size=config.get("bind_cache_size") or 10000,
+        refresh_interval=config.get("bind_refresh_interval"),
+    )
+
+    # archive
+    archive_service = None
+    if config.get("mongo_archive_collection"):
+        archive_service = ArchiveService(
+            mongodb[config["mongo_database"]][config["mongo_archive_collection"]],
+            batch_size=config.get("archive_batch_size") or 1000,
+        )
+        archive_service.start_rollover(router)
+
+    def warm_up_mongodb():
+        bind_service.ensure_index()
+        if bind_service.refresh_interval is not None:
+            bind_service.start_refresher()
+        else:
+            bind_service.preload()
+        if archive_service is not None:
+            archive_service.ensure_index()
+
+    # authorizing gspread, opening the spreadsheets and loading bindings are slow,
+    # so they run in the background while the bot logs in.
+    # commands like who and echo are answered meanwhile,
+    # and the others are served from the snapshot store or wait for the spreadsheet.
+    startup = ThreadPoolExecutor(max_workers=2, thread_name_prefix="startup")
+    startup.submit(
+        warm_up, "gspread", lambda: warm_up_gspread(client, router), started_at
+    )
+    startup.submit(warm_up, "mongodb", warm_up_mongodb, started_at)
+    startup.shutdown(wait=False)
+
+    # metrics
+    metrics.gauge(
+        "turnip_cache_hit_ratio",
+        lambda: pool.cache_stats()["hit_ratio"],
+        {"cache": "gspread"},
+    )
+    metrics.gauge(
+        "turnip_cache_hit_ratio",
+        lambda: bind_service.cache_stats()["hit_ratio"],
+        {"cache": "bind"},
+    )
+    if config.get("metrics_port"):
+        metrics.serve(int(config["metrics_port"]))
+    if config.get("metrics_log_interval"):
+        metrics.dump_periodically(float(config["metrics_log_interval"]))
 
     bot_service = TurnipPriceBotService(
-        config["discord_bot_token"], gspread_service, bind_service
+        config["discord_bot_token"],
+        router,
+        bind_service,
+        concurrency=config.get("respond_concurrency") or 8,
+        timeout=respond_timeout,
+        started_at=started_at,
+        archive_service=archive_service,
+        dedupe_size=config.get("dedupe_size") or 10000,
+        dedupe_ttl=config.get("dedupe_ttl") or 600,
+        view_ttl=config.get("respond_view_ttl") or 60,
     )
     bot_service.run()
+    if store is not None:
+        store.close()
 
     mongodb.close()
 
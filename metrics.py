@@ -0,0 +1,276 @@
+import bisect
+import contextlib
+import functools
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from logger import logger
+
+# seconds
+DEFAULT_BUCKETS = (
+    0.0001,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+)
+
+
+class Histogram:
+    """
+    cumulative histogram of latencies with fixed buckets like Prometheus.
+    quantiles are estimated by linear interpolation in a bucket.
+    """
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets: List[float] = sorted(buckets)
+        # counts[i] is the number of values in (buckets[i - 1], buckets[i]],
+        # the last one is for values larger than all buckets
+        self.counts: List[int] = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+
+    def quantile(self, q: float) -> float:
+        with self.lock:
+            counts = list(self.counts)
+            count = self.count
+        if count == 0:
+            return 0.0
+        rank = q * count
+        cumulative = 0
+        for i, n in enumerate(counts):
+            if n > 0 and cumulative + n >= rank:
+                if i == len(self.buckets):
+                    # no upper bound, use the largest bucket
+                    return self.buckets[-1]
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i]
+                return lower + (upper - lower) * (rank - cumulative) / n
+            cumulative += n
+        return self.buckets[-1]
+
+    def cumulative_counts(self) -> List[int]:
+        """
+        the number of values less than or equal to each bucket, and the total at last
+        """
+        with self.lock:
+            counts = list(self.counts)
+        res = []
+        total = 0
+        for n in counts:
+            total += n
+            res.append(total)
+        return res
+
+    def summary(self) -> Dict[str, float]:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+        }
+
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class MetricsRegistry:
+    """
+    histograms and gauges by name and labels, rendered in Prometheus text format
+    """
+
+    def __init__(self):
+        self.histograms: Dict[Tuple[str, Labels], Histogram] = {}
+        self.gauges: Dict[Tuple[str, Labels], Callable[[], float]] = {}
+        self.lock = threading.Lock()
+
+    def histogram(
+        self, name: str, labels: Optional[Dict[str, str]] = None
+    ) -> Histogram:
+        key = (name, to_labels(labels))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            return histogram
+
+    def gauge(
+        self,
+        name: str,
+        function: Callable[[], float],
+        labels: Optional[Dict[str, str]] = None,
+    ):
+        """
+        register a gauge. function is called when the metrics are rendered.
+        """
+        with self.lock:
+            self.gauges[(name, to_labels(labels))] = function
+
+    @contextlib.contextmanager
+    def span(self, stage: str) -> Iterator[None]:
+        """
+        measure the time of the block as a stage of the request path
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.histogram("turnip_stage_seconds", {"stage": stage}).observe(
+                time.perf_counter() - start
+            )
+
+    def timed(self, stage: str):
+        """
+        decorator version of span
+        """
+
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.span(stage):
+                    return function(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def render(self) -> str:
+        with self.lock:
+            histograms = sorted(self.histograms.items())
+            gauges = sorted(self.gauges.items(), key=lambda item: item[0])
+        lines = []
+        typed = set()
+        for (name, labels), histogram in histograms:
+            if name not in typed:
+                lines.append("# TYPE %s histogram" % name)
+                typed.add(name)
+            counts = histogram.cumulative_counts()
+            bounds = [format_float(b) for b in histogram.buckets] + ["+Inf"]
+            for bound, count in zip(bounds, counts):
+                lines.append(
+                    "%s_bucket%s %d"
+                    % (name, format_labels(labels + (("le", bound),)), count)
+                )
+            lines.append(
+                "%s_sum%s %s"
+                % (name, format_labels(labels), format_float(histogram.sum))
+            )
+            lines.append("%s_count%s %d" % (name, format_labels(labels), counts[-1]))
+        for (name, labels), function in gauges:
+            if name not in typed:
+                lines.append("# TYPE %s gauge" % name)
+                typed.add(name)
+            try:
+                value = function()
+            except Exception as e:
+                logger.warning("failed to get gauge %s. error: %s", name, e)
+                continue
+            lines.append("%s%s %s" % (name, format_labels(labels), format_float(value)))
+        return "\n".join(lines) + "\n"
+
+    def summaries(self) -> Dict[str, Dict[str, float]]:
+        """
+        count, sum and p50/p95/p99 of each histogram, keyed by name{labels}
+        """
+        with self.lock:
+            histograms = sorted(self.histograms.items())
+        return {
+            name + format_labels(labels): histogram.summary()
+            for (name, labels), histogram in histograms
+        }
+
+    def serve(self, port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+        """
+        serve the metrics on http://host:port/metrics in a daemon thread
+        """
+        registry = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+        thread = threading.Thread(
+            target=server.serve_forever, name="metrics-server", daemon=True
+        )
+        thread.start()
+        logger.info("serving metrics on http://%s:%d/metrics", host, port)
+        return server
+
+    def dump_periodically(self, interval: float) -> threading.Thread:
+        """
+        log the summaries every interval seconds in a daemon thread
+        """
+
+        def run():
+            while True:
+                time.sleep(interval)
+                for name, summary in self.summaries().items():
+                    if summary["count"] == 0:
+                        continue
+                    logger.info(
+                        "metrics %s count: %d, p50: %.4fs, p95: %.4fs, p99: %.4fs",
+                        name,
+                        summary["count"],
+                        summary["p50"],
+                        summary["p95"],
+                        summary["p99"],
+                    )
+
+        thread = threading.Thread(target=run, name="metrics-dump", daemon=True)
+        thread.start()
+        return thread
+
+
+def to_labels(labels: Optional[Dict[str, str]]) -> Labels:
+    return tuple(sorted((labels or {}).items()))
+
+
+def format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    return "{%s}" % ",".join(
+        '%s="%s"' % (key, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for key, value in labels
+    )
+
+
+def format_float(value: float) -> str:
+    return repr(float(value))
+
+
+# the registry of this process
+metrics = MetricsRegistry()
@@ -2,10 +2,54 @@ import datetime
 import re
 
 import discord
-import jaconv
 
 import parse_result
 from logger import logger
+from metrics import metrics
+
+# the first group matched is the command. `.` doesn't match newlines
+COMMAND_PATTERN = re.compile(
+    r"(?P<update>\+(?P<rest>.*))"
+    r"|(?P<hist>hist)"
+    r"|(?P<pred>pred|予測|型)"
+    r"|(?P<past>past|過去)"
+    r"|(?P<top>top|ランキング)"
+    r"|(?P<bind>im)"
+    r"|(?P<who>who)"
+    r"|(?P<echo>echo)"
+)
+# (price, weekday, am, pm) tokens of an update command
+UPDATE_TOKEN_PATTERN = re.compile(
+    r"([0-9]+)|([買月火水木金土])|(am|午前|ごぜん|gozen)|(pm|午後|ごご|gogo)"
+)
+ISO_WEEKDAYS = ["買値", "月", "火", "水", "木", "金", "土"]
+WEEKDAY_INDEXES = {"買": 0, "月": 1, "火": 2, "水": 3, "木": 4, "金": 5, "土": 6}
+TERMS = [
+    "買値",
+    "買値",
+    "月AM",
+    "月PM",
+    "火AM",
+    "火PM",
+    "水AM",
+    "水PM",
+    "木AM",
+    "木PM",
+    "金AM",
+    "金PM",
+    "土AM",
+    "土PM",
+]
+# zenkaku ascii chars and the zenkaku space to hankaku.
+# same as jaconv.z2h(kana=False, digit=True, ascii=True)
+Z2H_TABLE = {code: code - 0xFEE0 for code in range(0xFF01, 0xFF5F)}
+Z2H_TABLE[0x3000] = 0x20
+# term -> the term before it. (-1) % 3 == 2 in Python
+PREVIOUS_TERMS = {term: TERMS[(TERMS.index(term) - 1) % len(TERMS)] for term in TERMS}
+# weeks of past without the number
+DEFAULT_PAST_WEEKS = 4
+# members of top without the number
+DEFAULT_TOP_COUNT = 5
 
 
 class ParseService:
@@ -16,12 +60,8 @@ class ParseService:
     def __init__(self, user: discord.User):
         self.user: discord.User = user
 
+    @metrics.timed("parse_recognize")
     def recognize(self, message: discord.Message) -> parse_result.ParseResult:
-        # see https://stackoverflow.com/a/13287083
-        message_time: datetime.datetime = message.created_at.replace(
-            tzinfo=datetime.timezone.utc
-        ).astimezone(tz=None)
-
         try:
             validate(self.user, message)
         except ValueError as e:
@@ -34,31 +74,49 @@ class ParseService:
         if len(normalized_body) == 0:
             return parse_result.EmptyRequest()
 
-        m = re.search(r"^\+(.*)", normalized_body)
-        if m:
-            return parse_update_command(m.group(1).strip(), message_time)
-
-        m = re.search(r"^hist", normalized_body)
-        if m:
+        m = COMMAND_PATTERN.match(normalized_body)
+        command = m.lastgroup if m else None
+        if command == "update":
+            return parse_update_command(m.group("rest").strip(), message_time(message))
+        elif command == "hist":
             return parse_result.HistoryRequest()
-
-        m = re.search(r"^(im)(.*)", normalized_body)
-        if m:
-            prefix_length = len(m.group(1))
-            name = raw_body[prefix_length:].strip()
+        elif command == "pred":
+            return parse_result.PredictionRequest()
+        elif command == "top":
+            rest = normalized_body[m.end() :].strip()
+            if rest == "":
+                count = DEFAULT_TOP_COUNT
+            elif rest.isdecimal() and int(rest) > 0:
+                count = int(rest)
+            else:
+                return parse_result.UnknownRequest()
+            return parse_result.TopRequest(current_term(message_time(message)), count)
+        elif command == "past":
+            rest = normalized_body[m.end() :].strip()
+            if rest == "":
+                return parse_result.PastHistoryRequest(DEFAULT_PAST_WEEKS)
+            if not rest.isdecimal() or int(rest) == 0:
+                return parse_result.UnknownRequest()
+            return parse_result.PastHistoryRequest(int(rest))
+        elif command == "bind":
+            name = raw_body[len(m.group("bind")) :].strip()
             return parse_result.BindRequest(name)
-
-        m = re.search(r"^who", normalized_body)
-        if m:
+        elif command == "who":
             return parse_result.WhoAmIRequest()
-
-        m = re.search(r"^echo", normalized_body)
-        if m:
+        elif command == "echo":
             return parse_result.EchoRequest(raw_body)
 
         return parse_result.UnknownRequest()
 
 
+def message_time(message: discord.Message) -> datetime.datetime:
+    """
+    created time of the message in the local time zone
+    """
+    # see https://stackoverflow.com/a/13287083
+    return message.created_at.replace(tzinfo=datetime.timezone.utc).astimezone(tz=None)
+
+
 def validate(myself: discord.User, message: discord.Message):
     """
     ignore message from bot and not mention
@@ -89,8 +147,10 @@ def normalize(command: str) -> str:
     - strip
     """
     command: str = command.strip()
+    if command.isascii():
+        return command.lower()
     # zenkaku to hankaku
-    command = jaconv.z2h(command, kana=False, digit=True, ascii=True)
+    command = command.translate(Z2H_TABLE)
     # downcase
     command = command.lower()
     # strip
@@ -111,73 +171,97 @@ def parse_update_command(
     - 月 100
     - 買い 100
     - 買値 100
+    - 100 100/64 32/- (一括登録)
     """
+    if "/" in normalized_command:
+        return parse_bulk_update_command(normalized_command)
 
-    ISO_WEEKDAYS = ["買値", "月", "火", "水", "木", "金", "土"]
-    TERMS = [
-        "買値",
-        "買値",
-        "月AM",
-        "月PM",
-        "火AM",
-        "火PM",
-        "水AM",
-        "水PM",
-        "木AM",
-        "木PM",
-        "金AM",
-        "金PM",
-        "土AM",
-        "土PM",
-    ]
-
-    # read price
+    # read price, weekday and am. or pm. in one pass
     price = None
-    m = re.search(r"[0-9]+", normalized_command)
-    if m is not None:
-        price = int(m.group())
+    weekday_index = None
+    ampm = None
+    for number, wd, am, pm in UPDATE_TOKEN_PATTERN.findall(normalized_command):
+        if number:
+            if price is None:
+                price = int(number)
+        elif wd:
+            # 買 is prior to the others, and 月 is prior to 火 and so on
+            index = WEEKDAY_INDEXES[wd]
+            if weekday_index is None or index < weekday_index:
+                weekday_index = index
+        elif pm:
+            ampm = "PM"
+        elif ampm is None:
+            ampm = "AM"
     if price is None:
         return parse_result.InvalidUpdateRequest()
 
     # read term or use current if not given
-    # read weekday
-    weekday = None
-    for wd in ISO_WEEKDAYS:
-        if wd in normalized_command:
-            weekday = wd
-            break
-    if "買" in normalized_command:
-        weekday = "買値"
-
-    # read am. or pm.
-    ampm = None
-    for am in ["am", "午前", "ごぜん", "gozen"]:
-        if am in normalized_command:
-            ampm = "AM"
-    for pm in ["pm", "午後", "ごご", "gogo"]:
-        if pm in normalized_command:
-            ampm = "PM"
+    weekday = None if weekday_index is None else ISO_WEEKDAYS[weekday_index]
 
     # どちらも指定されていない
     if weekday != "買値" and (weekday is None) != (ampm is None):
         logger.info("invalid update request. none or both of weekday and ampm must be specified. weekday=%s, ampm=%s", weekday, ampm)
         return parse_result.InvalidUpdateRequest()
     # use current
-    backward = False
     if (weekday is None) and (ampm is None):
         logger.info("term is not specified. use current time")
-        weekday = ISO_WEEKDAYS[current.isoweekday() % len(ISO_WEEKDAYS)]
-        ampm = "AM" if current.hour < 12 else "PM"
-        backward = current.hour < 5
+        return parse_result.UpdateRequest(current_term(current), price)
 
     if weekday == "買値":
         term: str = weekday
     else:
         term: str = "{}{}".format(weekday, ampm)
+    return parse_result.UpdateRequest(term, price)
+
+
+def current_term(current: datetime.datetime) -> str:
+    """
+    the term of the time, 買値 on Sunday
+    """
+    weekday = ISO_WEEKDAYS[current.isoweekday() % len(ISO_WEEKDAYS)]
+    ampm = "AM" if current.hour < 12 else "PM"
+    if weekday == "買値":
+        term = weekday
+    else:
+        term = "{}{}".format(weekday, ampm)
 
     # 午前5時前なら1つ戻す
-    if backward:
-        logger.info("term is not specified and hour=%s, go backward", current.hour)
-        index = TERMS.index(term)
-        term = TERMS[(index - 1) % len(TERMS)]  # (-1) % 3 == 2 in Python
-    return parse_result.UpdateRequest(term, price)
+    if current.hour < 5:
+        logger.info("hour=%s, go backward", current.hour)
+        term = PREVIOUS_TERMS[term]
+    return term
+
+
+def parse_bulk_update_command(normalized_command: str) -> parse_result.ParseResult:
+    """
+    半角小文字に正規化された一括登録コマンドをパースする
+    hist の出力と同じ `買値 月AM/月PM 火AM/火PM ...` の形式で、`-` は更新しない
+    example:
+    - 100 100/64 32/- -/- -/- -/- -/-
+    - - 100/64
+    """
+    tokens = normalized_command.split()
+    if len(tokens) < 2 or len(tokens) > 7:
+        return parse_result.InvalidUpdateRequest()
+
+    values = [tokens[0]]
+    for token in tokens[1:]:
+        pair = token.split("/")
+        if len(pair) != 2:
+            return parse_result.InvalidUpdateRequest()
+        values += pair
+
+    prices = []
+    for value in values:
+        if value == "-":
+            prices.append(None)
+        elif re.fullmatch(r"[0-9]+", value):
+            prices.append(int(value))
+        else:
+            logger.info("invalid bulk update request. value=%s", value)
+            return parse_result.InvalidUpdateRequest()
+    if all(price is None for price in prices):
+        return parse_result.InvalidUpdateRequest()
+    prices += [None] * (13 - len(prices))
+    return parse_result.BulkUpdateRequest(prices)
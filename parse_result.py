@@ -1,4 +1,5 @@
 from dataclasses import dataclass
+from typing import List, Optional
 
 
 class ParseResult:
@@ -11,11 +12,36 @@ class UpdateRequest(ParseResult):
     price: int
 
 
+@dataclass
+class BulkUpdateRequest(ParseResult):
+    # 買値, 月AM, 月PM, ..., 土PM. None is not updated
+    prices: List[Optional[int]]
+
+
 @dataclass
 class HistoryRequest(ParseResult):
     pass
 
 
+@dataclass
+class PredictionRequest(ParseResult):
+    pass
+
+
+@dataclass
+class PastHistoryRequest(ParseResult):
+    # number of weeks
+    weeks: int
+
+
+@dataclass
+class TopRequest(ParseResult):
+    # sell term like 月AM, or 買値 on Sunday
+    term: str
+    # number of members
+    count: int
+
+
 @dataclass
 class InvalidUpdateRequest(ParseResult):
     pass
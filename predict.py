@@ -0,0 +1,188 @@
+import functools
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+# see https://gist.github.com/Treeki/85be14d297c80c8b3c0a76375743325b
+PATTERNS = ["波型", "跳ね大型", "減少型", "跳ね小型"]
+# TRANSITIONS[last week][this week]
+TRANSITIONS = np.array(
+    [
+        [0.20, 0.30, 0.15, 0.35],
+        [0.50, 0.05, 0.20, 0.25],
+        [0.25, 0.45, 0.05, 0.25],
+        [0.45, 0.25, 0.15, 0.15],
+    ]
+)
+BUY_PRICES = np.arange(90, 111)
+SELL_TERMS = 12
+
+History = Tuple[Optional[int], ...]
+
+
+@dataclass
+class Prediction:
+    # probability of each pattern in PATTERNS
+    probabilities: List[float]
+    # (min, max) of 月AM ... 土PM
+    ranges: List[Tuple[int, int]]
+
+
+@dataclass
+class Variant:
+    """
+    one way the game generates prices of a pattern.
+    the price of a term is intceil(rate * buy price) + offset
+    and the rate is in [lows[i], highs[i]].
+    """
+
+    pattern: int
+    weight: float
+    lows: List[float]
+    highs: List[float]
+    offsets: List[int]
+
+
+@functools.lru_cache(maxsize=4096)
+def predict(history: History) -> Optional[Prediction]:
+    """
+    predict the pattern and the price ranges from a normalized history
+    (買値, 月AM, ..., 土PM). returns None if no pattern matches the history.
+
+    the probability of each variant is its prior times the likelihood
+    of the observed prices, where a price is assumed to be uniformly distributed
+    in its range. the ranges of decreasing phases are bounded
+    without conditioning on the observed prices, so they may be wider than exact.
+    """
+    if len(history) != 1 + SELL_TERMS:
+        raise ValueError("length must be %d" % (1 + SELL_TERMS))
+    patterns, weights, lows, highs, offsets = variant_arrays()
+    buy, sells = history[0], history[1:]
+    bases = BUY_PRICES if buy is None else np.array([buy])
+
+    # (variants, buy prices, terms)
+    scaled_lows = lows[:, None, :] * bases[None, :, None]
+    scaled_highs = highs[:, None, :] * bases[None, :, None]
+    mins = np.floor(scaled_lows + 0.99999).astype(int) + offsets[:, None, :]
+    maxs = np.floor(scaled_highs + 0.99999).astype(int) + offsets[:, None, :]
+
+    observed = np.array([price is not None for price in sells])
+    prices = np.array([0 if price is None else price for price in sells])
+    inside = (mins <= prices) & (prices <= maxs)
+    matched = np.all(inside | ~observed, axis=-1)
+    likelihood = np.prod(np.where(observed, 1.0 / (maxs - mins + 1), 1.0), axis=-1)
+
+    probabilities = stationary_distribution()[patterns] * weights
+    posterior = probabilities[:, None] * likelihood * matched
+    total = posterior.sum()
+    if total == 0:
+        return None
+
+    pattern_probabilities = [
+        float(posterior[patterns == pattern].sum() / total)
+        for pattern in range(len(PATTERNS))
+    ]
+    lower = np.where(matched[..., None], mins, np.iinfo(int).max).min(axis=(0, 1))
+    upper = np.where(matched[..., None], maxs, np.iinfo(int).min).max(axis=(0, 1))
+    ranges = [
+        (price, price) if price is not None else (int(low), int(high))
+        for price, low, high in zip(sells, lower, upper)
+    ]
+    return Prediction(pattern_probabilities, ranges)
+
+
+@functools.lru_cache(maxsize=None)
+def stationary_distribution() -> np.ndarray:
+    """
+    the pattern distribution when last week's pattern is unknown
+    """
+    values, vectors = np.linalg.eig(TRANSITIONS.T)
+    vector = np.real(vectors[:, np.argmin(np.abs(values - 1))])
+    return vector / vector.sum()
+
+
+@functools.lru_cache(maxsize=None)
+def variant_arrays() -> Tuple[np.ndarray, ...]:
+    """
+    returns (patterns, weights, lows, highs, offsets) of all variants as arrays
+    """
+    variants = enumerate_variants()
+    return (
+        np.array([v.pattern for v in variants]),
+        np.array([v.weight for v in variants]),
+        np.array([v.lows for v in variants]),
+        np.array([v.highs for v in variants]),
+        np.array([v.offsets for v in variants]),
+    )
+
+
+def enumerate_variants() -> List[Variant]:
+    variants = []
+
+    # 波型: high, decreasing, high, decreasing, high
+    for dec_length1 in [2, 3]:
+        dec_length2 = 5 - dec_length1
+        for high_length1 in range(0, 7):
+            for high_length3 in range(0, 7 - high_length1):
+                high_length2 = 7 - high_length1 - high_length3
+                phases = (
+                    [(0.9, 1.4)] * high_length1
+                    + decreasing(0.6, 0.8, 0.04, 0.06, dec_length1)
+                    + [(0.9, 1.4)] * high_length2
+                    + decreasing(0.6, 0.8, 0.04, 0.06, dec_length2)
+                    + [(0.9, 1.4)] * high_length3
+                )
+                weight = 1 / 2 * 1 / 7 * 1 / (7 - high_length1)
+                variants.append(variant(0, weight, phases))
+
+    # 跳ね大型: decreasing, large spike, low
+    for peak_start in range(1, 8):
+        phases = (
+            decreasing(0.85, 0.9, 0.03, 0.02, peak_start)
+            + [(0.9, 1.4), (1.4, 2.0), (2.0, 6.0), (1.4, 2.0), (0.9, 1.4)]
+            + [(0.4, 0.9)] * (SELL_TERMS - peak_start - 5)
+        )
+        variants.append(variant(1, 1 / 7, phases))
+
+    # 減少型
+    variants.append(variant(2, 1, decreasing(0.85, 0.9, 0.03, 0.02, SELL_TERMS)))
+
+    # 跳ね小型: decreasing, small spike, decreasing
+    for peak_start in range(0, 8):
+        phases = (
+            decreasing(0.4, 0.9, 0.03, 0.02, peak_start)
+            + [(0.9, 1.4), (0.9, 1.4), (1.4, 2.0), (1.4, 2.0), (1.4, 2.0)]
+            + decreasing(0.4, 0.9, 0.03, 0.02, SELL_TERMS - peak_start - 5)
+        )
+        offsets = [0] * SELL_TERMS
+        offsets[peak_start + 2] = offsets[peak_start + 4] = -1
+        variants.append(variant(3, 1 / 8, phases, offsets))
+
+    return variants
+
+
+def variant(
+    pattern: int,
+    weight: float,
+    phases: List[Tuple[float, float]],
+    offsets: Optional[List[int]] = None,
+) -> Variant:
+    if len(phases) != SELL_TERMS:
+        raise ValueError("length must be %d" % SELL_TERMS)
+    return Variant(
+        pattern,
+        weight,
+        [low for low, _ in phases],
+        [high for _, high in phases],
+        offsets or [0] * SELL_TERMS,
+    )
+
+
+def decreasing(
+    low: float, high: float, step: float, random_step: float, length: int
+) -> List[Tuple[float, float]]:
+    """
+    rate starts in [low, high] and decreases by step + [0, random_step] each term
+    """
+    return [(low - i * (step + random_step), high - i * step) for i in range(length)]
@@ -0,0 +1,93 @@
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from table import TERMS_LENGTH
+
+# blank or non-numeric cells
+MISSING = -1
+DTYPE = np.int16
+MAX_PRICE = np.iinfo(DTYPE).max
+
+
+class PriceMatrix:
+    """
+    prices of 買値, 月AM, ..., 土PM per member as an int16 matrix of (members, terms).
+    missing prices are MISSING, which is less than any price,
+    so max is the max of the prices and a comparison with a price excludes them.
+    """
+
+    def __init__(self, names: List[str], prices: np.ndarray):
+        if prices.shape != (len(names), TERMS_LENGTH):
+            raise ValueError("shape must be (%d, %d)" % (len(names), TERMS_LENGTH))
+        self.names = names
+        # name -> first index, same as TurnipPriceTableViewService.user_rows
+        self.indexes: Dict[str, int] = {}
+        for i, name in enumerate(names):
+            self.indexes.setdefault(name, i)
+        self.prices = prices
+
+    @classmethod
+    def from_cells(cls, names: List[str], cells: List[List[str]]) -> "PriceMatrix":
+        """
+        cells are the 13 cells of each member as strings
+        """
+        prices = np.array(
+            [[parse_price(cell) for cell in row] for row in cells], dtype=DTYPE
+        ).reshape(len(cells), TERMS_LENGTH)
+        return cls(names, prices)
+
+    def set(self, index: int, term: int, cell: str):
+        self.prices[index, term] = parse_price(cell)
+
+    def history(self, name: str) -> Optional[Tuple[Optional[int], ...]]:
+        """
+        the prices of the member as the history passed to predict.predict,
+        None for missing prices
+        """
+        index = self.indexes.get(name)
+        if index is None:
+            return None
+        return tuple(
+            None if price == MISSING else price for price in self.prices[index].tolist()
+        )
+
+    def observed(self) -> np.ndarray:
+        return self.prices != MISSING
+
+    def term_max(self) -> np.ndarray:
+        """
+        the max price of each term, MISSING if nobody has the price
+        """
+        if len(self.names) == 0:
+            return np.full(TERMS_LENGTH, MISSING, dtype=DTYPE)
+        return self.prices.max(axis=0)
+
+    def term_mean(self) -> np.ndarray:
+        """
+        the mean price of each term, nan if nobody has the price
+        """
+        observed = self.observed()
+        counts = observed.sum(axis=0)
+        sums = np.where(observed, self.prices, 0).sum(axis=0, dtype=np.int64)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(counts > 0, sums / counts, np.nan)
+
+    def ratios(self) -> np.ndarray:
+        """
+        (members, 12) sell prices divided by the buy price, nan if either is missing
+        """
+        observed = self.observed()
+        buys = self.prices[:, :1].astype(np.float64)
+        sells = self.prices[:, 1:].astype(np.float64)
+        valid = observed[:, 1:] & observed[:, :1]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(valid, sells / buys, np.nan)
+
+
+def parse_price(cell: str) -> int:
+    cell = cell.strip()
+    if not cell.isdecimal():
+        return MISSING
+    price = int(cell)
+    return price if price <= MAX_PRICE else MISSING
@@ -0,0 +1,106 @@
+import threading
+import time
+from typing import Dict, Optional
+
+from metrics import MetricsRegistry, metrics
+
+READ = "read"
+WRITE = "write"
+
+
+class TokenBucket:
+    """
+    rate tokens per second, at most capacity tokens
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        """
+        seconds until a token is available, 0 if available now
+        """
+        self.refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+class RateLimiter:
+    """
+    token buckets of Sheets API reads and writes, shared by all GspreadService.
+
+    a request blocks until its bucket has a token. reads give way while writes are waiting,
+    so a burst of hist does not delay registrations.
+    a budget of None is not limited.
+    """
+
+    def __init__(
+        self,
+        read_per_minute: Optional[float] = 60,
+        write_per_minute: Optional[float] = 60,
+        burst: float = 10,
+        registry: MetricsRegistry = metrics,
+    ):
+        self.buckets: Dict[str, Optional[TokenBucket]] = {
+            READ: bucket(read_per_minute, burst),
+            WRITE: bucket(write_per_minute, burst),
+        }
+        # kind -> number of requests waiting for a token
+        self.waiting: Dict[str, int] = {READ: 0, WRITE: 0}
+        self.condition = threading.Condition()
+        self.throttle_times = {
+            kind: registry.histogram(
+                "turnip_ratelimit_throttle_seconds", {"kind": kind}
+            )
+            for kind in (READ, WRITE)
+        }
+        for kind in (READ, WRITE):
+            registry.gauge(
+                "turnip_ratelimit_queue_depth",
+                lambda kind=kind: self.waiting[kind],
+                {"kind": kind},
+            )
+
+    def acquire(self, kind: str):
+        """
+        block until a request of kind (READ or WRITE) is allowed
+        """
+        bucket_ = self.buckets[kind]
+        if bucket_ is None:
+            return
+        start = time.monotonic()
+        with self.condition:
+            self.waiting[kind] += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    writes = self.buckets[WRITE]
+                    if kind == READ and self.waiting[WRITE] > 0 and writes is not None:
+                        wait = writes.wait_time(now)
+                    else:
+                        wait = bucket_.wait_time(now)
+                        if wait <= 0:
+                            bucket_.take()
+                            break
+                    self.condition.wait(max(wait, 0.001))
+            finally:
+                self.waiting[kind] -= 1
+                self.condition.notify_all()
+        self.throttle_times[kind].observe(time.monotonic() - start)
+
+
+def bucket(per_minute: Optional[float], burst: float) -> Optional[TokenBucket]:
+    if per_minute is None:
+        return None
+    return TokenBucket(per_minute / 60, max(1.0, min(burst, per_minute)))
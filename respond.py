@@ -1,68 +1,211 @@
-from typing import Optional, List
+import time
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Tuple, Type
 
 import discord
 
 import parse_result
 import table
+from archive import ArchiveService
 from bind import BindService
-from gspreads import GspreadService
 from logger import logger
+from metrics import Histogram, MetricsRegistry, metrics
+from routing import Route, SheetRouter
 from table import TurnipPriceTableViewService
 
+if TYPE_CHECKING:
+    import predict
+
+
+# reply to messages from guilds and channels without spreadsheet
+NO_ROUTE_MESSAGE = "このサーバーで使うスプレッドシートが設定されていません。\n" "開発者は config.yml の routes を確認してください。"
+
+# reply to members whose name in the spreadsheet is not bound
+NOT_BOUND_MESSAGE = (
+    "スプレッドシートでの名前が bot に登録されていません。\n"
+    "スプレッドシートに名前を入力してから `@[kabu] iam [スプレッドシートでの名前]` とリプライして登録してください。"
+)
+
+# at most weeks replied to past
+MAX_PAST_WEEKS = 12
+# at most members replied to top
+MAX_TOP_COUNT = 20
+
+# returns the reply to the message, or None not to reply
+Handler = Callable[[discord.Message, parse_result.ParseResult], Optional[str]]
+
 
 class RespondService:
-    def __init__(self, gspread_service: GspreadService, bind_service: BindService):
-        self.gspread_service = gspread_service
+    """
+    reply to a ParseResult by the handler registered for its type
+    """
+
+    def __init__(
+        self,
+        router: SheetRouter,
+        bind_service: BindService,
+        registry: MetricsRegistry = metrics,
+        archive_service: Optional[ArchiveService] = None,
+        view_ttl: float = 60,
+    ):
+        self.router = router
         self.bind_service = bind_service
+        self.archive_service = archive_service
+        self.registry = registry
+        # seconds to reuse the view of a route before reading the whole worksheet again
+        self.view_ttl = view_ttl
+        # route -> (table, view of the table, monotonic time when the view was built,
+        # whether the table is a snapshot loaded from the store and not reconciled)
+        self.table_views: Dict[
+            Route, Tuple[List[List[str]], TurnipPriceTableViewService, float, bool]
+        ] = {}
+        # (route, row) -> (view, (layout version, row version), rendered history)
+        self.rendered_histories: Dict[
+            Tuple[Route, int],
+            Tuple[TurnipPriceTableViewService, Tuple[int, int], str],
+        ] = {}
+        self.handlers: Dict[Type[parse_result.ParseResult], Handler] = {}
+        # request type name -> latency of the handler
+        self.handler_latencies: Dict[str, Histogram] = {}
 
-    def respond_to(
-        self, message: discord.Message, request: parse_result.ParseResult
-    ) -> Optional[str]:
-        author: discord.Member = message.author
-        # FIXME: remove too many if. resolve handler method by type(request).__name__ ?
-        if isinstance(request, parse_result.SimplePostRequest):
-            return request.content
-        elif isinstance(request, parse_result.UpdateRequest):
-            return self.handle_update_request(author, request)
-        elif isinstance(request, parse_result.HistoryRequest):
-            return self.handle_history_request(author)
-        elif isinstance(request, parse_result.InvalidUpdateRequest):
+        self.register(
+            parse_result.SimplePostRequest, lambda message, request: request.content
+        )
+        self.register(
+            parse_result.UpdateRequest,
+            lambda message, request: self.handle_update_request(
+                message.author, request, self.router.resolve(message)
+            ),
+        )
+        self.register(
+            parse_result.BulkUpdateRequest,
+            lambda message, request: self.handle_bulk_update_request(
+                message.author, request, self.router.resolve(message)
+            ),
+        )
+        self.register(
+            parse_result.HistoryRequest,
+            lambda message, request: self.handle_history_request(
+                message.author, self.router.resolve(message)
+            ),
+        )
+        self.register(
+            parse_result.PredictionRequest,
+            lambda message, request: self.handle_prediction_request(
+                message.author, self.router.resolve(message)
+            ),
+        )
+        self.register(
+            parse_result.TopRequest,
+            lambda message, request: self.handle_top_request(
+                request, self.router.resolve(message)
+            ),
+        )
+        if archive_service is not None:
+            self.register(
+                parse_result.PastHistoryRequest,
+                lambda message, request: self.handle_past_history_request(
+                    message.author, request, self.router.resolve(message)
+                ),
+            )
+        self.register(
+            parse_result.InvalidUpdateRequest,
             # TODO: @[kabu] を外部から注入する
-            return (
+            lambda message, request: (
                 "カブ価と期間は正しく入力されていますか？\n"
                 "現在時刻で登録: `@[kabu] +100` (価格は必須です)\n"
                 "売値を期間を指定して登録: `@[kabu] +100 月AM` (曜日と午前午後は指定するなら両方必要です)"
-                "買値登録: `@[kabu] +100 買い`"
+                "買値登録: `@[kabu] +100 買い`\n"
+                "一括登録: `@[kabu] +100 100/64 32/-` (買値 月AM/月PM 火AM/火PM ... の順、`-` は更新しません)"
+            ),
+        )
+        self.register(
+            parse_result.BindRequest,
+            lambda message, request: self.handle_bind_request(
+                message.author, request
+            ),
+        )
+        self.register(
+            parse_result.WhoAmIRequest,
+            lambda message, request: self.handle_who_am_i_request(message.author),
+        )
+        self.register(parse_result.IgnorableRequest, lambda message, request: None)
+        self.register(
+            parse_result.EchoRequest, lambda message, request: message.content
+        )
+        self.register(parse_result.EmptyRequest, lambda message, request: "やぁ☆")
+        self.register(
+            parse_result.UnknownRequest, lambda message, request: "分かりません。"
+        )
+
+    def register(self, request_type: Type[parse_result.ParseResult], handler: Handler):
+        """
+        register the handler of request_type. it replaces the current one if exists.
+        """
+        self.handlers[request_type] = handler
+        self.handler_latencies.setdefault(
+            request_type.__name__,
+            self.registry.histogram(
+                "turnip_handler_seconds", {"request": request_type.__name__}
+            ),
+        )
+
+    def respond_to(
+        self, message: discord.Message, request: parse_result.ParseResult
+    ) -> Optional[str]:
+        handler = self.handlers.get(type(request))
+        request_type = type(request)
+        if handler is None:
+            # subclass of a registered type
+            request_type = next(
+                (t for t in type(request).__mro__ if t in self.handlers), None
             )
-        elif isinstance(request, parse_result.BindRequest):
-            return self.handle_bind_request(author, request)
-        elif isinstance(request, parse_result.WhoAmIRequest):
-            return self.handle_who_am_i_request(author)
-        elif isinstance(request, parse_result.IgnorableRequest):
-            return None
-        elif isinstance(request, parse_result.EchoRequest):
-            return message.content
-        elif isinstance(request, parse_result.EmptyRequest):
-            return "やぁ☆"
-        elif isinstance(request, parse_result.UnknownRequest):
-            return "分かりません。"
-        else:
-            logger.warn("response not implemented. message id: %s", message.id)
-            return "実装されていません。"
+            if request_type is None:
+                logger.warn("response not implemented. message id: %s", message.id)
+                return "実装されていません。"
+            handler = self.handlers[request_type]
+
+        start = time.perf_counter()
+        try:
+            return handler(message, request)
+        finally:
+            self.handler_latencies[request_type.__name__].observe(
+                time.perf_counter() - start
+            )
+
+    def handler_stats(self) -> Dict[str, Dict[str, float]]:
+        """
+        returns count, sum and p50/p95/p99 latency in seconds of each handler
+        """
+        return {
+            name: histogram.summary()
+            for name, histogram in self.handler_latencies.items()
+        }
+
+    def bound_name(
+        self, author: discord.Member, route: Optional[Route]
+    ) -> Tuple[Optional[str], Optional[str]]:
+        """
+        returns (name bound to the author, None),
+        or (None, reply) if the route is not found or the author is not bound
+        """
+        if route is None:
+            return None, NO_ROUTE_MESSAGE
+        name = self.bind_service.find_name(author.id)
+        if name is None:
+            return None, NOT_BOUND_MESSAGE
+        return name, None
 
     def handle_update_request(
-        self, author: discord.Member, request: parse_result.UpdateRequest
+        self,
+        author: discord.Member,
+        request: parse_result.UpdateRequest,
+        route: Optional[Route],
     ) -> str:
-        # get position to write on sheet 0
-        sheet_index = 0
-        raw_table = self.gspread_service.get_table(sheet_index)
-        table_service = TurnipPriceTableViewService(raw_table)
-        name = self.bind_service.find_name(author.id)
+        name, reply = self.bound_name(author, route)
         if name is None:
-            return (
-                "スプレッドシートでの名前が bot に登録されていません。\n"
-                "スプレッドシートに名前を入力してから `@[kabu] iam [スプレッドシートでの名前]` とリプライして登録してください。"
-            )
+            return reply
+        # locate the cell on the live sheet, not on a snapshot restored from the disk
+        table_service = self.get_user_view(route, name, live=True)
         position = table_service.find_position(name, request.term)
         if isinstance(position, table.UserNotFound):
             logger.info("user not found on table. user: %s", author)
@@ -75,16 +218,16 @@ class RespondService:
 
         # try to write
         row, column = position.user_row, position.term_column
-        org_price = format_price(raw_table[row][column])
+        org_price = format_price(table_service.table[row][column])
         try:
-            table_service.table[row][column] = str(request.price)
-            table_service.trans[column][row] = str(request.price)
-            self.gspread_service.update_cell(
-                sheet_index, row + 1, column + 1, request.price
+            self.router.service(route).update_cell(
+                route.sheet, row + 1, column + 1, request.price
             )
         except Exception as e:
             logger.error("failed to write to table. error: %s", e, exc_info=True)
             return "[error] スプレッドシートへの書き込みに失敗しました。\n" "開発者は確認してください。"
+        # the table may be the cached snapshot, so modify it only after the write succeeded
+        table_service.update(row, column, str(request.price))
 
         logger.info(
             "successfully updated. row: %s, column: %s, %s -> %s",
@@ -95,8 +238,7 @@ class RespondService:
         )
 
         # get history
-        _, column_left, column_right = table_service.find_terms_range()
-        history = table_service.find_user_history(name)
+        history = self.render_history(route, table_service, name)
 
         logger.info("history: %s", history)
         return (
@@ -108,28 +250,272 @@ class RespondService:
                 org_price,
                 request.price,
                 name,
-                format_history(history),
+                history,
                 row,
                 column,
             )
         )
 
-    def handle_history_request(self, author: discord.Member) -> str:
-        # FIXME: dup
-        sheet_index = 0
-        raw_table = self.gspread_service.get_table(sheet_index)
-        table_service = TurnipPriceTableViewService(raw_table)
-        name = self.bind_service.find_name(author.id)
+    def handle_bulk_update_request(
+        self,
+        author: discord.Member,
+        request: parse_result.BulkUpdateRequest,
+        route: Optional[Route],
+    ) -> str:
+        name, reply = self.bound_name(author, route)
         if name is None:
-            # FIXME: dup
-            return (
-                "スプレッドシートでの名前が bot に登録されていません。\n"
-                "スプレッドシートに名前を入力してから `@[kabu] iam [スプレッドシートでの名前]` とリプライして登録してください。"
+            return reply
+        table_service = self.get_user_view(route, name, live=True)
+        position = table_service.find_position(name, table.TERMS_ROW_IDENTIFIER)
+        if isinstance(position, table.UserNotFound):
+            logger.info("user not found on table. user: %s", author)
+            return "スプレッドシートからあなたの名前が見つかりませんでした。\n" "bot に登録された名前 `%s` は正しいですか？" % name
+        if not isinstance(position, table.Found):
+            logger.error(
+                "user not found on table. user: %s, request: %s", author, request
             )
+            return "[error] スプレッドシートのどこに書けばいいか分かりません。\n" "開発者は確認してください。"
+
+        # try to write the row at once
+        row, left = position.user_row, position.term_column
+        cells = [
+            (row, left + i, price)
+            for i, price in enumerate(request.prices)
+            if price is not None
+        ]
+        try:
+            self.router.service(route).update_cells(
+                route.sheet,
+                [(row + 1, column + 1, price) for row, column, price in cells],
+            )
+        except Exception as e:
+            logger.error("failed to write to table. error: %s", e, exc_info=True)
+            return "[error] スプレッドシートへの書き込みに失敗しました。\n" "開発者は確認してください。"
+        for row, column, price in cells:
+            table_service.update(row, column, str(price))
+
+        logger.info(
+            "successfully updated. row: %s, columns: %s, prices: %s",
+            row,
+            [column for _, column, _ in cells],
+            request.prices,
+        )
+
+        history = self.render_history(route, table_service, name)
+        return (
+            "スプレッドシートに書きました。\n"
+            "書き込んだセル数: {} | スプレッドシートでの名前: `{}`\n"
+            "履歴: {}".format(len(cells), name, history)
+        )
+
+    def get_table_view(
+        self, route: Route, live: bool = False
+    ) -> TurnipPriceTableViewService:
+        """
+        returns the view of the worksheet of the route. the view is reused while
+        GspreadService returns the same snapshot.
+        if live, the view is not built from a snapshot restored from the store.
+        """
+        service = self.router.service(route)
+        raw_table = service.get_table(route.sheet, live=live)
+        cached = self.table_views.get(route)
+        if cached is not None and cached[0] is raw_table:
+            return cached[1]
+        table_service = TurnipPriceTableViewService(raw_table)
+        self.table_views[route] = (
+            raw_table,
+            table_service,
+            time.monotonic(),
+            service.is_restored(route.sheet, raw_table),
+        )
+        return table_service
+
+    def cached_view(
+        self, route: Route, live: bool = False
+    ) -> Optional[TurnipPriceTableViewService]:
+        """
+        the view of the route if it was built in the last view_ttl seconds.
+        when the view expired, the snapshot is expired with it, so that the rows
+        of other members and cells edited by hand in the sheet are read again.
+        the view is kept for get_table_view while the snapshot is served
+        because the sheet can't be read.
+        if live, a view built from a snapshot restored from the store is not returned.
+        """
+        cached = self.table_views.get(route)
+        if cached is None or (live and cached[3]):
+            return None
+        if time.monotonic() - cached[2] < self.view_ttl:
+            return cached[1]
+        self.router.service(route).expire(route.sheet)
+        return None
+
+    def get_user_view(
+        self, route: Route, name: str, live: bool = False
+    ) -> TurnipPriceTableViewService:
+        """
+        returns the view of the worksheet of the route whose row of the user is up to date.
+        pass live=True to write with the view, see get_table_view.
+
+        once the view is built, only the terms header and the row of the user
+        are read by one request for view_ttl seconds. the whole worksheet is read again
+        when the view expired, the user is not in the view
+        or the header or the name in the row has moved.
+        the view has its own copy of the table, so updating it doesn't touch
+        the snapshot shared in GspreadService.
+        """
+        service = self.router.service(route)
+        view = self.cached_view(route, live)
+        if view is not None:
+            row = view.user_rows.get(name)
+            terms_range = view.find_terms_range()
+            if row is not None and terms_range is not None:
+                terms_row, left, right = terms_range
+                # the names may be on either side of the prices
+                first = min(left, view.users_column)
+                last = max(right, view.users_column + 1)
+                header, cells = service.get_ranges(
+                    route.sheet,
+                    [
+                        (terms_row + 1, left + 1, terms_row + 1, right),
+                        (row + 1, first + 1, row + 1, last),
+                    ],
+                    live=live,
+                )
+                if (
+                    header[0] == view.table[terms_row][left:right]
+                    and cells[0][view.users_column - first] == name
+                ):
+                    for i, value in enumerate(cells[0]):
+                        # not to invalidate the rendered history of the row
+                        if view.table[row][first + i] != value:
+                            view.update(row, first + i, value)
+                    return view
+                logger.info("layout of the sheet changed. route: %s", route)
+            service.expire(route.sheet)
+        return self.get_table_view(route, live)
+
+    def render_history(
+        self, route: Route, table_service: TurnipPriceTableViewService, name: str
+    ) -> Optional[str]:
+        """
+        format_history of the user, memoized until the row of the user
+        or the layout of the view changes
+        """
+        row = table_service.user_rows.get(name)
+        if row is None:
+            return None
+        version = (
+            table_service.layout_version,
+            table_service.row_versions.get(row, 0),
+        )
+        cached = self.rendered_histories.get((route, row))
+        if cached is not None and cached[0] is table_service and cached[1] == version:
+            return cached[2]
+        rendered = format_history(table_service.find_user_history(name))
+        self.rendered_histories[(route, row)] = (table_service, version, rendered)
+        return rendered
+
+    def handle_history_request(
+        self, author: discord.Member, route: Optional[Route]
+    ) -> str:
+        name, reply = self.bound_name(author, route)
+        if name is None:
+            return reply
+        table_service = self.get_user_view(route, name)
+        history = self.render_history(route, table_service, name)
+        if history is None:
+            return "スプレッドシートからあなたの名前が見つかりませんでした。\n" "bot に登録された名前 `%s` は正しいですか？" % name
+        return "{}の履歴: {}".format(name, history)
+
+    def handle_prediction_request(
+        self, author: discord.Member, route: Optional[Route]
+    ) -> str:
+        name, reply = self.bound_name(author, route)
+        if name is None:
+            return reply
+        table_service = self.get_user_view(route, name)
         history = table_service.find_user_history(name)
         if history is None:
             return "スプレッドシートからあなたの名前が見つかりませんでした。\n" "bot に登録された名前 `%s` は正しいですか？" % name
-        return "{}の履歴: {}".format(name, format_history(history))
+        # numpy is slow to import, so import it at the first prediction
+        import predict
+
+        with table_service.lock:
+            price_history = table_service.price_matrix().history(name)
+        prediction = predict.predict(price_history)
+        if prediction is None:
+            return "{}の履歴: {}\n" "当てはまる型が見つかりませんでした。履歴は正しいですか？".format(
+                name, self.render_history(route, table_service, name)
+            )
+        return "{}の履歴: {}\n{}".format(
+            name,
+            self.render_history(route, table_service, name),
+            format_prediction(history, prediction),
+        )
+
+    def handle_top_request(
+        self, request: parse_result.TopRequest, route: Optional[Route]
+    ) -> str:
+        if route is None:
+            return NO_ROUTE_MESSAGE
+        if request.term == table.TERMS_ROW_IDENTIFIER:
+            return "日曜日はカブを売れません。"
+        # the view kept up to date by updates, read the sheet only if not yet or expired
+        table_service = self.cached_view(route) or self.get_table_view(route)
+        # other threads update the rankings through the view
+        with table_service.lock:
+            ranking = table_service.leaderboard()
+            column = table_service.term_columns.get(request.term)
+            if ranking is None or column is None:
+                return "[error] スプレッドシートから `{}` の列が見つかりませんでした。\n" "開発者は確認してください。".format(
+                    request.term
+                )
+            _, left, _ = table_service.find_terms_range()
+            by_price, by_ratio = ranking.top(
+                column - left, min(request.count, MAX_TOP_COUNT)
+            )
+        if not by_price:
+            return "{}の売値はまだ登録されていません。".format(request.term)
+        return "{}の売値ランキング\n価格: {}\n買値比: {}".format(
+            request.term,
+            " / ".join(
+                "{}. {} {}".format(i + 1, name, price)
+                for i, (name, price) in enumerate(by_price)
+            ),
+            " / ".join(
+                "{}. {} {:.2f}倍 ({})".format(i + 1, name, ratio, price)
+                for i, (name, price, ratio) in enumerate(by_ratio)
+            )
+            or "-",
+        )
+
+    def handle_past_history_request(
+        self,
+        author: discord.Member,
+        request: parse_result.PastHistoryRequest,
+        route: Optional[Route],
+    ) -> str:
+        name, reply = self.bound_name(author, route)
+        if name is None:
+            return reply
+        weeks = self.archive_service.find_weeks(
+            route, name, min(request.weeks, MAX_PAST_WEEKS)
+        )
+        if not weeks:
+            return "{}の過去の記録はありません。".format(name)
+        return "{}の過去{}週:\n{}".format(
+            name,
+            len(weeks),
+            "\n".join(
+                "{}の週: {}".format(
+                    week,
+                    format_history(
+                        ["" if price is None else str(price) for price in prices]
+                    ),
+                )
+                for week, prices in weeks
+            ),
+        )
 
     def handle_bind_request(
         self, author: discord.Member, request: parse_result.BindRequest
@@ -162,14 +548,37 @@ class RespondService:
 def format_history(history: List[str]) -> str:
     if len(history) != 13:
         raise ValueError("length must be 13")
-    res = "%s" % history[0]
-    for i in list(range(1, 13, 2)):
-        am, pm = history[i], history[i + 1]
-        res += " %s/%s" % (format_price(am), format_price(pm))
-    return res
+    return " ".join(
+        ["%s" % history[0]]
+        + [
+            "%s/%s" % (format_price(history[i]), format_price(history[i + 1]))
+            for i in range(1, 13, 2)
+        ]
+    )
 
 
 def format_price(price) -> str:
     if (price or "").strip() == "":
         price = "-"
     return price
+
+
+def format_prediction(history: List[str], prediction: "predict.Prediction") -> str:
+    import predict
+
+    probabilities = " / ".join(
+        "%s %d%%" % (pattern, round(probability * 100))
+        for pattern, probability in zip(predict.PATTERNS, prediction.probabilities)
+        if probability > 0
+    )
+    res = "型: %s" % probabilities
+    terms = [
+        "%s %d-%d" % (term, low, high)
+        for term, price, (low, high) in zip(
+            table.SELL_TERMS, history[1:], prediction.ranges
+        )
+        if (price or "").strip() == ""
+    ]
+    if terms:
+        res += "\n予想: %s" % " / ".join(terms)
+    return res
@@ -0,0 +1,132 @@
+import functools
+import threading
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional
+
+import discord
+
+from gspreads import GspreadService
+
+
+@dataclass(frozen=True)
+class Route:
+    # key of the spreadsheet, or the path of TSV for the local backend
+    spreadsheet: str
+    # index of the worksheet
+    sheet: int = 0
+
+
+class SpreadsheetPool:
+    """
+    GspreadService of each spreadsheet, created at the first use and shared by routes
+    """
+
+    def __init__(
+        self,
+        opener: Callable[[str], List[Any]],
+        **service_options,
+    ):
+        """
+        opener opens worksheets of the spreadsheet key.
+        service_options are passed to GspreadService.
+        """
+        self.opener = opener
+        self.service_options = service_options
+        self.services: Dict[str, GspreadService] = {}
+        self.lock = threading.Lock()
+
+    def get(self, key: str) -> GspreadService:
+        service = self.services.get(key)
+        if service is not None:
+            return service
+        with self.lock:
+            service = self.services.get(key)
+            if service is None:
+                # the spreadsheet is opened at the first request of the service
+                service = GspreadService(
+                    None,
+                    opener=functools.partial(self.opener, key),
+                    key=key,
+                    **self.service_options,
+                )
+                self.services[key] = service
+            return service
+
+    def add(self, key: str, service: GspreadService):
+        """
+        register an already opened service
+        """
+        self.services[key] = service
+
+    def close(self):
+        for service in list(self.services.values()):
+            service.close()
+
+    def cache_stats(self) -> Dict[str, float]:
+        hits = sum(s.cache_hits for s in self.services.values())
+        misses = sum(s.cache_misses for s in self.services.values())
+        total = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_ratio": hits / total if total > 0 else 0.0,
+        }
+
+
+class SheetRouter:
+    """
+    resolve the worksheet of a message by its channel, then its guild, then the default
+    """
+
+    def __init__(
+        self,
+        pool: SpreadsheetPool,
+        default: Optional[Route] = None,
+        guilds: Optional[Dict[int, Route]] = None,
+        channels: Optional[Dict[int, Route]] = None,
+    ):
+        self.pool = pool
+        self.default = default
+        self.guilds = guilds or {}
+        self.channels = channels or {}
+
+    @classmethod
+    def from_config(
+        cls, pool: SpreadsheetPool, routes: List[dict], default: Optional[Route]
+    ) -> "SheetRouter":
+        """
+        routes are like {"guild": 123, "spreadsheet": "key", "sheet": 0}
+        or {"channel": 456, "spreadsheet": "key"}
+        """
+        guilds, channels = {}, {}
+        for config in routes:
+            route = Route(str(config["spreadsheet"]), int(config.get("sheet") or 0))
+            if config.get("channel") is not None:
+                channels[int(config["channel"])] = route
+            elif config.get("guild") is not None:
+                guilds[int(config["guild"])] = route
+            else:
+                raise ValueError("route needs guild or channel: %s" % config)
+        return cls(pool, default, guilds, channels)
+
+    def resolve(self, message: discord.Message) -> Optional[Route]:
+        channel = getattr(message, "channel", None)
+        route = self.channels.get(getattr(channel, "id", None))
+        if route is not None:
+            return route
+        guild = getattr(message, "guild", None)
+        route = self.guilds.get(getattr(guild, "id", None))
+        if route is not None:
+            return route
+        return self.default
+
+    def routes(self) -> List[Route]:
+        """
+        all routes without duplicates, the default first
+        """
+        routes = [self.default] if self.default is not None else []
+        routes += list(self.channels.values()) + list(self.guilds.values())
+        return list(dict.fromkeys(routes))
+
+    def service(self, route: Route) -> GspreadService:
+        return self.pool.get(route.spreadsheet)
@@ -0,0 +1,106 @@
+import json
+import sqlite3
+import threading
+import time
+import zlib
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List
+
+from logger import logger
+
+
+@dataclass
+class StoredSnapshot:
+    table: List[List[str]]
+    # incremented on every save of the worksheet
+    version: int
+    # unix time when saved
+    saved_at: float
+
+
+class SnapshotStore:
+    """
+    last known tables of worksheets in a SQLite file, to serve reads right after
+    a restart or while Sheets is down. tables are saved as zlib-compressed JSON.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS snapshots ("
+            "spreadsheet TEXT NOT NULL, "
+            "sheet INTEGER NOT NULL, "
+            "version INTEGER NOT NULL, "
+            "saved_at REAL NOT NULL, "
+            "data BLOB NOT NULL, "
+            "PRIMARY KEY (spreadsheet, sheet))"
+        )
+        self.connection.commit()
+        self.lock = threading.Lock()
+        # saves run in order on one thread
+        self.executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="snapshot-store"
+        )
+
+    def load(self, spreadsheet: str) -> Dict[int, StoredSnapshot]:
+        """
+        snapshots of the worksheets of the spreadsheet by sheet index
+        """
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT sheet, version, saved_at, data FROM snapshots "
+                "WHERE spreadsheet = ?",
+                (spreadsheet,),
+            ).fetchall()
+        return {
+            sheet: StoredSnapshot(
+                json.loads(zlib.decompress(data).decode("utf-8")), version, saved_at
+            )
+            for sheet, version, saved_at, data in rows
+        }
+
+    def save(self, spreadsheet: str, sheet: int, table: List[List[str]]):
+        self.write(spreadsheet, sheet, encode(table))
+
+    def save_async(
+        self, spreadsheet: str, sheet: int, table: List[List[str]]
+    ) -> Future:
+        """
+        save in the background. the table is serialized before this returns,
+        so the caller may modify it later.
+        """
+        return self.executor.submit(self.write, spreadsheet, sheet, encode(table))
+
+    def write(self, spreadsheet: str, sheet: int, data: bytes):
+        try:
+            with self.lock, self.connection:
+                self.connection.execute(
+                    "INSERT INTO snapshots (spreadsheet, sheet, version, saved_at, data) "
+                    "VALUES (?, ?, 1, ?, ?) "
+                    "ON CONFLICT (spreadsheet, sheet) DO UPDATE SET "
+                    "version = version + 1, saved_at = excluded.saved_at, data = excluded.data",
+                    (spreadsheet, sheet, time.time(), data),
+                )
+        except sqlite3.Error as e:
+            logger.error(
+                "failed to save the snapshot of sheet %d of %s. error: %s",
+                sheet,
+                spreadsheet,
+                e,
+            )
+
+    def close(self):
+        """
+        wait for queued saves and close the file
+        """
+        self.executor.shutdown(wait=True)
+        with self.lock:
+            self.connection.close()
+
+
+def encode(table: List[List[str]]) -> bytes:
+    return zlib.compress(
+        json.dumps(table, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    )
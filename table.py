@@ -1,5 +1,30 @@
+import threading
 from dataclasses import dataclass
-from typing import List, Optional, Tuple
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+from metrics import metrics
+
+if TYPE_CHECKING:
+    from leaderboard import Leaderboard
+    from price_matrix import PriceMatrix
+
+USER_COLUMN_IDENTIFIER = "なまえ"
+TERMS_ROW_IDENTIFIER = "買値"
+TERMS_LENGTH = 13
+SELL_TERMS = [
+    "月AM",
+    "月PM",
+    "火AM",
+    "火PM",
+    "水AM",
+    "水PM",
+    "木AM",
+    "木PM",
+    "金AM",
+    "金PM",
+    "土AM",
+    "土PM",
+]
 
 
 class FindResult:
@@ -30,58 +55,134 @@ class TermNotFound(FindResult):
 
 
 class TurnipPriceTableViewService:
+    """
+    view of the table returned by GspreadService.get_table.
+    the view works on its own copy of the table and never modifies the argument.
+
+    the header positions and the indexes (user name -> row, term -> column)
+    are built once in __init__, so lookups don't scan the table.
+    write cells through update to keep the indexes consistent.
+    update also counts the writes to each row in row_versions,
+    and rebuilding the indexes increments layout_version.
+    price_matrix is the numeric view of the prices, and leaderboard is the ranking
+    of them. both are built at the first call and kept consistent by update.
+    the view is shared by worker threads. update and the builds hold lock,
+    and readers of price_matrix or leaderboard should hold it too.
+    """
+
+    @metrics.timed("table_view")
     def __init__(self, table: List[List[str]]):
+        # the table may be the snapshot shared by GspreadService, so pad a copy
         max_len = max(map(len, table))
-        for row in table:
-            while len(row) < max_len:
-                row.append("")
-        self.table = table
-        trans = list(map(list, zip(*table)))
-        self.trans = trans
+        self.table = [row + [""] * (max_len - len(row)) for row in table]
+        self.lock = threading.RLock()
+        # row -> number of writes to the row
+        self.row_versions: Dict[int, int] = {}
+        self.layout_version = 0
+        self.build_index()
+
+    def build_index(self):
+        """
+        build the indexes into locals and replace them at the end,
+        so that other threads reading the view never see them half built
+        """
+        # the first row containing "買値" and the first column containing "なまえ"
+        terms_row: Optional[int] = None
+        users_column: Optional[int] = None
+        # the row of "なまえ" in the users column
+        users_head_row: Optional[int] = None
+        for i, row in enumerate(self.table):
+            if terms_row is None and TERMS_ROW_IDENTIFIER in row:
+                terms_row = i
+            if USER_COLUMN_IDENTIFIER in row:
+                column = row.index(USER_COLUMN_IDENTIFIER)
+                if users_column is None or column < users_column:
+                    users_column = column
+        if users_column is not None:
+            users_head_row = self.find_row(users_column, USER_COLUMN_IDENTIFIER)
+
+        # value -> first index, same as list.index
+        user_rows: Dict[str, int] = {}
+        if users_column is not None:
+            for i, row in enumerate(self.table):
+                user_rows.setdefault(row[users_column], i)
+        term_columns: Dict[str, int] = {}
+        if terms_row is not None:
+            for i, term in enumerate(self.table[terms_row]):
+                term_columns.setdefault(term, i)
+
+        self.terms_row = terms_row
+        self.users_column = users_column
+        self.users_head_row = users_head_row
+        self.user_rows = user_rows
+        self.term_columns = term_columns
+        # rebuilt at the next call
+        self.prices: Optional["PriceMatrix"] = None
+        self.ranking: Optional["Leaderboard"] = None
+
+    def find_row(self, column: int, value: str) -> Optional[int]:
+        return next(
+            (i for i, row in enumerate(self.table) if row[column] == value), None
+        )
+
+    def update(self, row: int, column: int, value: str):
+        """
+        write a cell (zero-origin) and keep the indexes consistent.
+        price cells are O(1), only a write to the header row or column rebuilds them,
+        whether the value has changed or not.
+        the row version is incremented even if the value is the same.
+        """
+        with self.lock:
+            org = self.table[row][column]
+            self.table[row][column] = value
+            self.row_versions[row] = self.row_versions.get(row, 0) + 1
+            if self.prices is not None and row > self.users_head_row:
+                _, left, right = self.find_terms_range()
+                if left <= column < right:
+                    index, term = row - self.users_head_row - 1, column - left
+                    old = int(self.prices.prices[index, term])
+                    self.prices.set(index, term, value)
+                    if self.ranking is not None:
+                        self.ranking.update(index, term, old)
+            identifiers = (USER_COLUMN_IDENTIFIER, TERMS_ROW_IDENTIFIER)
+            if (
+                row == self.terms_row
+                or column == self.users_column
+                or value in identifiers
+                or org in identifiers
+            ):
+                self.build_index()
+                self.layout_version += 1
 
     def find_position(self, user: str, term: str) -> FindResult:
         """
         returns the tuple (updated operation list, original history, new history)
         """
-        row_id = self.find_terms_row()
-        column_id = self.find_users_column()
-        if row_id is None:
+        if self.terms_row is None:
             return TermRowNotFound()
-        if column_id is None:
+        if self.users_column is None:
             return UserColumnNotFound()
 
-        # find the header row and column
-        rows = self.table  # just an alias
-        columns = self.trans
-
-        if user not in columns[column_id]:
+        row = self.user_rows.get(user)
+        if row is None:
             return UserNotFound()
-        if term not in rows[row_id]:
+        column = self.term_columns.get(term)
+        if column is None:
             return TermNotFound()
 
-        return Found(columns[column_id].index(user), rows[row_id].index(term))
+        return Found(row, column)
 
     def find_users_column(self) -> Optional[int]:
-        user_column_identifier = "なまえ"
-        return next(
-            (i for i, col in enumerate(self.trans) if (user_column_identifier in col)),
-            None,
-        )
+        return self.users_column
 
     def find_terms_row(self) -> Optional[int]:
-        terms_row_identifier = "買値"
-        return next(
-            (i for i, row in enumerate(self.table) if (terms_row_identifier in row)),
-            None,
-        )
+        return self.terms_row
 
     def find_users(self) -> Optional[List[str]]:
-        head_identifier = "なまえ"
-        users_column = self.find_users_column()
-        if users_column is None:
+        if self.users_column is None:
             return None
-        index = self.trans[users_column].index(head_identifier)
-        return self.trans[users_column][index + 1 :]
+        column = self.users_column
+        return [row[column] for row in self.table[self.users_head_row + 1 :]]
 
     def find_terms(self) -> Optional[List[str]]:
         row, left, right = self.find_terms_range()
@@ -91,17 +192,46 @@ class TurnipPriceTableViewService:
         """
         returns (row, column_left, column_right)
         """
-        head_identifier = "買値"
-        terms_row = self.find_terms_row()
-        if terms_row is None:
+        if self.terms_row is None:
             return None
-        idx = self.table[terms_row].index(head_identifier)
-        return terms_row, idx, idx + 13
+        idx = self.term_columns[TERMS_ROW_IDENTIFIER]
+        return self.terms_row, idx, idx + TERMS_LENGTH
+
+    def price_matrix(self) -> Optional["PriceMatrix"]:
+        """
+        prices of the rows below the users header, None if the header is not found
+        """
+        with self.lock:
+            if self.users_column is None or self.terms_row is None:
+                return None
+            if self.prices is None:
+                # numpy is slow to import
+                from price_matrix import PriceMatrix
+
+                _, left, right = self.find_terms_range()
+                rows = self.table[self.users_head_row + 1 :]
+                self.prices = PriceMatrix.from_cells(
+                    [row[self.users_column] for row in rows],
+                    [row[left:right] for row in rows],
+                )
+            return self.prices
+
+    def leaderboard(self) -> Optional["Leaderboard"]:
+        with self.lock:
+            if self.ranking is None:
+                matrix = self.price_matrix()
+                if matrix is None:
+                    return None
+                from leaderboard import Leaderboard
+
+                self.ranking = Leaderboard(matrix)
+            return self.ranking
 
     def find_user_history(self, user: str) -> Optional[List[str]]:
-        users_col = self.find_users_column()
-        if user not in self.trans[users_col]:
+        if self.users_column is None:
+            return None
+        row = self.user_rows.get(user)
+        if row is None:
             return None
-        row = self.trans[users_col].index(user)
         _, left, right = self.find_terms_range()
         return self.table[row][left:right]
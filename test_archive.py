@@ -0,0 +1,86 @@
+import datetime
+from unittest import TestCase
+from unittest.mock import Mock
+
+import archive
+import test_table
+from routing import Route
+
+
+class TestArchive(TestCase):
+    def test_unpack_prices(self):
+        data = archive.PRICES_FORMAT.pack(99, -1, 64, *[-1] * 9, 600)
+        self.assertEqual(len(data), 26)
+        self.assertEqual(
+            archive.unpack_prices(data), [99, None, 64] + [None] * 9 + [600]
+        )
+
+    def test_week_start(self):
+        self.assertEqual(
+            archive.week_start(datetime.datetime(2020, 4, 15, 11, 30)),
+            datetime.date(2020, 4, 12),
+        )
+        self.assertEqual(
+            archive.week_start(datetime.datetime(2020, 4, 12, 5, 0)),
+            datetime.date(2020, 4, 12),
+        )
+        # before 5:00 on Sunday is the last week
+        self.assertEqual(
+            archive.week_start(datetime.datetime(2020, 4, 12, 4, 59)),
+            datetime.date(2020, 4, 5),
+        )
+        self.assertEqual(
+            archive.next_rollover(datetime.datetime(2020, 4, 15, 11, 30)),
+            datetime.datetime(2020, 4, 19, 5, 0),
+        )
+
+    def test_documents(self):
+        docs = list(
+            archive.documents(
+                Route("key"),
+                datetime.date(2020, 4, 12),
+                test_table.test_table("testdata.tsv"),
+            )
+        )
+        bob = next(doc for doc in docs if doc["name"] == "bob")
+        self.assertEqual(bob["week"], "2020-04-12")
+        self.assertEqual(
+            archive.unpack_prices(bob["prices"]),
+            [109, 94, 89, 121, 207, 495, 167, 111, 76, 95, 63, 45, 81],
+        )
+        self.assertNotIn("なまえ", [doc["name"] for doc in docs])
+
+    def test_documents_out_of_range(self):
+        table = test_table.test_table("testdata.tsv")
+        # bob's 月AM, larger than int16
+        table[4][3] = "40000"
+        docs = list(archive.documents(Route("key"), datetime.date(2020, 4, 12), table))
+        bob = next(doc for doc in docs if doc["name"] == "bob")
+        self.assertEqual(archive.unpack_prices(bob["prices"])[:3], [109, None, 89])
+
+    def test_archive(self):
+        collection = Mock()
+        service = archive.ArchiveService(collection, batch_size=2)
+        count = service.archive(
+            Route("key"),
+            datetime.date(2020, 4, 12),
+            test_table.test_table("testdata.tsv"),
+        )
+        batches = [call.args[0] for call in collection.bulk_write.call_args_list]
+        self.assertEqual(sum(len(batch) for batch in batches), count)
+        self.assertTrue(all(len(batch) <= 2 for batch in batches))
+
+    def test_find_weeks(self):
+        collection = Mock()
+        collection.find.return_value.sort.return_value.limit.return_value = [
+            {
+                "week": "2020-04-12",
+                "prices": archive.PRICES_FORMAT.pack(100, *[-1] * 12),
+            }
+        ]
+        service = archive.ArchiveService(collection)
+        self.assertEqual(
+            service.find_weeks(Route("key"), "bob", 4),
+            [("2020-04-12", [100] + [None] * 12)],
+        )
+        collection.find.return_value.sort.return_value.limit.assert_called_once_with(4)
@@ -1,5 +1,7 @@
+import time
 from unittest import TestCase
 
+import pymongo
 import pymongo_inmemory
 
 from bind import BindService
@@ -18,3 +20,58 @@ class TestMongoNameIdBindService(TestCase):
         self.assertEqual(binds.find_name(1), "a")
         binds.bind(1, "b")
         self.assertEqual(binds.find_name(1), "b")
+
+    def test_cache(self):
+        client = pymongo_inmemory.MongoClient()
+        collection = client["testdb"]["user_bindings_cache"]
+        collection.insert_one({"id": 1, "name": "a"})
+
+        binds = BindService(collection, cache_size=2)
+        binds.preload()
+        self.assertEqual(binds.find_name(1), "a")
+        self.assertEqual(binds.cache_stats()["hits"], 1)
+
+        # write-through
+        binds.bind(2, "b")
+        self.assertEqual(binds.find_name(2), "b")
+        self.assertEqual(binds.cache_stats()["misses"], 0)
+
+        # LRU eviction
+        binds.bind(3, "c")
+        self.assertEqual(binds.cache_stats()["size"], 2)
+        self.assertEqual(binds.find_name(1), "a")
+        self.assertEqual(binds.cache_stats()["misses"], 1)
+
+    def test_ensure_index(self):
+        client = pymongo_inmemory.MongoClient()
+        collection = client["testdb"]["user_bindings_index"]
+
+        binds = BindService(collection)
+        binds.ensure_index()
+        binds.bind(1, "a")
+        binds.bind(1, "b")
+        self.assertEqual(collection.count_documents({"id": 1}), 1)
+        with self.assertRaises(pymongo.errors.DuplicateKeyError):
+            collection.insert_one({"id": 1, "name": "c"})
+
+    def test_refresh(self):
+        client = pymongo_inmemory.MongoClient()
+        collection = client["testdb"]["user_bindings_refresh"]
+        collection.insert_one({"id": 1, "name": "a"})
+
+        binds = BindService(collection, refresh_interval=0.05)
+        # not loaded yet, find_one without scanning the collection
+        self.assertEqual(binds.find_name(1), "a")
+        self.assertIsNone(binds.loaded_at)
+
+        binds.start_refresher()
+        self.assertIsNotNone(binds.loaded_at)
+        # bound by another process, seen after the reload in the background
+        collection.insert_one({"id": 2, "name": "b"})
+        loaded_at = binds.loaded_at
+        for _ in range(100):
+            if binds.loaded_at != loaded_at:
+                break
+            time.sleep(0.01)
+        self.assertEqual(binds.find_name(2), "b")
+        self.assertEqual(binds.cache_stats()["misses"], 1)
@@ -0,0 +1,134 @@
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+from unittest import IsolatedAsyncioTestCase
+from unittest.mock import AsyncMock, Mock
+
+import parse_result
+from bot import ERROR_MESSAGE, TIMEOUT_MESSAGE, TurnipPriceBotService
+from routing import Route, SheetRouter, SpreadsheetPool
+
+
+class TestTurnipPriceBotService(IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        self.bot = bot_service(concurrency=8, timeout=5)
+        self.addCleanup(self.bot.executor.shutdown)
+        # content -> seconds the handler takes
+        self.durations = {}
+        # (content, "start" or "end")
+        self.events = []
+        self.running = 0
+        self.max_running = 0
+        self.lock = threading.Lock()
+        self.bot.respond_service = Mock()
+        self.bot.respond_service.respond_to.side_effect = self.respond_to
+        self.sent = []
+        self.next_id = 0
+
+    def respond_to(self, message, request):
+        with self.lock:
+            self.events.append((message.content, "start"))
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(self.durations.get(message.content, 0))
+        with self.lock:
+            self.events.append((message.content, "end"))
+            self.running -= 1
+        if message.content == "error":
+            raise RuntimeError("quota")
+        return "reply to " + message.content
+
+    def message(self, content: str, author_id: int) -> SimpleNamespace:
+        self.next_id += 1
+
+        async def send(response):
+            self.sent.append((content, response))
+
+        return SimpleNamespace(
+            id=self.next_id,
+            content=content,
+            author=SimpleNamespace(id=author_id),
+            channel=SimpleNamespace(send=AsyncMock(side_effect=send)),
+        )
+
+    async def test_same_author_in_order(self):
+        self.durations["first"] = 0.2
+        await asyncio.gather(
+            self.bot.on_message(self.message("first", 1)),
+            self.bot.on_message(self.message("second", 1)),
+        )
+        self.assertEqual(
+            self.events,
+            [
+                ("first", "start"),
+                ("first", "end"),
+                ("second", "start"),
+                ("second", "end"),
+            ],
+        )
+        self.assertEqual(
+            self.sent,
+            [("first", "reply to first"), ("second", "reply to second")],
+        )
+        self.assertEqual(self.bot.author_locks, {})
+
+    async def test_concurrency(self):
+        self.bot = bot_service(concurrency=2, timeout=5)
+        self.addCleanup(self.bot.executor.shutdown)
+        self.bot.respond_service = Mock()
+        self.bot.respond_service.respond_to.side_effect = self.respond_to
+        for i in range(4):
+            self.durations[str(i)] = 0.1
+        await asyncio.gather(
+            *(self.bot.on_message(self.message(str(i), i)) for i in range(4))
+        )
+        # different authors run in parallel up to concurrency
+        self.assertEqual(self.max_running, 2)
+        self.assertEqual(len(self.sent), 4)
+
+    async def test_timeout_keeps_author_lock(self):
+        self.bot.timeout = 0.05
+        self.durations["slow"] = 0.3
+        await asyncio.gather(
+            self.bot.on_message(self.message("slow", 1)),
+            self.bot.on_message(self.message("next", 1)),
+        )
+        # the next message waits for the handler which timed out
+        self.assertEqual(
+            self.events,
+            [("slow", "start"), ("slow", "end"), ("next", "start"), ("next", "end")],
+        )
+        self.assertEqual(
+            self.sent,
+            [
+                ("slow", TIMEOUT_MESSAGE),
+                ("slow", "reply to slow"),
+                ("next", "reply to next"),
+            ],
+        )
+
+    async def test_error_reply(self):
+        await self.bot.on_message(self.message("error", 1))
+        self.assertEqual(self.sent, [("error", ERROR_MESSAGE)])
+
+    async def test_duplicate(self):
+        message = self.message("first", 1)
+        await self.bot.on_message(message)
+        await self.bot.on_message(message)
+        self.assertEqual(self.sent, [("first", "reply to first")])
+
+
+def bot_service(concurrency: int, timeout: float) -> TurnipPriceBotService:
+    pool = SpreadsheetPool(None)
+    bot = TurnipPriceBotService(
+        "token",
+        SheetRouter(pool, Route("test")),
+        Mock(),
+        concurrency=concurrency,
+        timeout=timeout,
+    )
+    # client.user is None before login
+    bot.parse_service = Mock(user=None)
+    bot.parse_service.recognize.return_value = parse_result.EmptyRequest()
+    return bot
@@ -0,0 +1,49 @@
+from unittest import TestCase
+
+from dedupe import MessageDeduplicator
+from metrics import MetricsRegistry
+
+
+class TestMessageDeduplicator(TestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.registry = MetricsRegistry()
+
+    def deduplicator(self, size: int, ttl: float) -> MessageDeduplicator:
+        return MessageDeduplicator(
+            size, ttl, registry=self.registry, clock=lambda: self.now
+        )
+
+    def test_seen(self):
+        deduplicator = self.deduplicator(10, 60)
+        self.assertFalse(deduplicator.seen(1))
+        self.assertFalse(deduplicator.seen(2))
+        self.assertTrue(deduplicator.seen(1))
+        self.assertTrue(deduplicator.seen(1))
+        self.assertEqual(deduplicator.dropped, 2)
+        self.assertEqual(len(deduplicator), 2)
+        self.assertIn("turnip_duplicate_messages_dropped 2.0", self.registry.render())
+
+    def test_size(self):
+        deduplicator = self.deduplicator(3, 60)
+        for message_id in range(5):
+            self.assertFalse(deduplicator.seen(message_id))
+        # the oldest ones are forgotten
+        self.assertEqual(len(deduplicator), 3)
+        self.assertEqual(deduplicator.ids, {2, 3, 4})
+        self.assertFalse(deduplicator.seen(0))
+        self.assertTrue(deduplicator.seen(4))
+
+    def test_ttl(self):
+        deduplicator = self.deduplicator(10, 60)
+        deduplicator.seen(1)
+        self.now = 30
+        deduplicator.seen(2)
+        self.assertTrue(deduplicator.seen(1))
+        self.now = 60
+        self.assertFalse(deduplicator.seen(1))
+        self.assertTrue(deduplicator.seen(2))
+        # 2 expires and is seen again
+        self.now = 90
+        self.assertFalse(deduplicator.seen(2))
+        self.assertEqual(list(deduplicator.order), [(60, 1), (90, 2)])
@@ -0,0 +1,333 @@
+import datetime
+import functools
+import json
+import os
+import tempfile
+import time
+from types import SimpleNamespace
+from unittest import TestCase
+from unittest.mock import Mock, patch
+
+import gspread
+import rsa
+
+import gspreads
+from localsheet import QuotaExceededResponse
+from snapshot_store import SnapshotStore
+
+
+class TestGspreadService(TestCase):
+    def test_get_table_cached(self):
+        service, worksheet = gspread_service(cache_ttl=60)
+        worksheet.get_all_values.return_value = [["なまえ", "買値"], ["alice", ""]]
+
+        self.assertEqual(service.get_table(0), [["なまえ", "買値"], ["alice", ""]])
+        self.assertEqual(service.get_table(0), [["なまえ", "買値"], ["alice", ""]])
+        self.assertEqual(worksheet.get_all_values.call_count, 1)
+        self.assertEqual(service.cache_stats()["hits"], 1)
+        self.assertEqual(service.cache_stats()["misses"], 1)
+
+    def test_get_table_not_cached(self):
+        service, worksheet = gspread_service(cache_ttl=0)
+        worksheet.get_all_values.return_value = [["なまえ", "買値"]]
+
+        service.get_table(0)
+        service.get_table(0)
+        self.assertEqual(worksheet.get_all_values.call_count, 2)
+
+    def test_update_cell_patches_snapshot(self):
+        service, worksheet = gspread_service(cache_ttl=60)
+        worksheet.get_all_values.return_value = [["なまえ", "買値"], ["alice"]]
+
+        service.get_table(0)
+        service.update_cell(0, 2, 2, 100)
+        worksheet.update_cell.assert_called_once_with(2, 2, 100)
+        self.assertEqual(service.get_table(0), [["なまえ", "買値"], ["alice", "100"]])
+        self.assertEqual(worksheet.get_all_values.call_count, 1)
+
+    def test_update_cell_failure_keeps_snapshot(self):
+        service, worksheet = gspread_service(cache_ttl=60)
+        worksheet.get_all_values.return_value = [["なまえ", "買値"], ["alice", ""]]
+        worksheet.update_cell.side_effect = RuntimeError("quota")
+
+        service.get_table(0)
+        with self.assertRaises(RuntimeError):
+            service.update_cell(0, 2, 2, 100)
+        self.assertEqual(service.get_table(0), [["なまえ", "買値"], ["alice", ""]])
+
+    def test_write_while_fetching(self):
+        service, worksheet = gspread_service(cache_ttl=60)
+
+        def get_all_values():
+            # written after the read started, not in the response
+            service.update_cell(0, 2, 2, 100)
+            return [["なまえ", "買値"], ["alice", ""]]
+
+        worksheet.get_all_values.side_effect = get_all_values
+        self.assertEqual(service.get_table(0), [["なまえ", "買値"], ["alice", "100"]])
+        self.assertEqual(service.get_table(0)[1], ["alice", "100"])
+        self.assertEqual(service.patches, {})
+        self.assertEqual(service.fetching, {})
+
+    def test_update_cells(self):
+        service, worksheet = gspread_service(cache_ttl=60)
+        worksheet.get_all_values.return_value = [
+            ["なまえ", "買値", "月AM", "月PM"],
+            ["alice"],
+        ]
+        service.get_table(0)
+        service.update_cells(0, [(2, 4, 64), (2, 2, 100), (2, 3, 90), (3, 2, 99)])
+        worksheet.batch_update.assert_called_once_with(
+            [
+                {"range": "B2:D2", "values": [[100, 90, 64]]},
+                {"range": "B3", "values": [[99]]},
+            ],
+            value_input_option="USER_ENTERED",
+        )
+        # row 3 is out of the snapshot, so it is fetched again
+        self.assertEqual(worksheet.get_all_values.call_count, 1)
+        self.assertEqual(service.get_table(0)[1], ["alice", "100", "90", "64"])
+        self.assertEqual(worksheet.get_all_values.call_count, 2)
+
+    def test_update_cell_write_behind(self):
+        service, worksheet = gspread_service(cache_ttl=60, write_behind=True)
+        worksheet.get_all_values.return_value = [["なまえ", "買値"], ["alice", ""]]
+        service.get_table(0)
+        service.update_cell(0, 2, 2, 100)
+        worksheet.batch_update.assert_called_once_with(
+            [{"range": "B2", "values": [[100]]}], value_input_option="USER_ENTERED"
+        )
+        self.assertEqual(service.get_table(0)[1], ["alice", "100"])
+        service.close()
+
+    def test_get_ranges(self):
+        service, worksheet = gspread_service(cache_ttl=60)
+        worksheet.batch_get.return_value = [[["なまえ", "買値"]], [["alice"]]]
+        self.assertEqual(
+            service.get_ranges(0, [(1, 1, 1, 2), (2, 1, 2, 2)]),
+            [[["なまえ", "買値"]], [["alice", ""]]],
+        )
+        worksheet.batch_get.assert_called_once_with(["A1:B1", "A2:B2"])
+
+        # sliced from the snapshot
+        worksheet.get_all_values.return_value = [["なまえ", "買値"], ["alice", "99"]]
+        service.get_table(0)
+        self.assertEqual(service.get_ranges(0, [(2, 2, 3, 2)]), [[["99"], [""]]])
+        self.assertEqual(worksheet.batch_get.call_count, 1)
+
+    def test_snapshot_store(self):
+        with tempfile.TemporaryDirectory() as directory:
+            store = SnapshotStore(os.path.join(directory, "snapshots.sqlite3"))
+            store.save("key", 0, [["なまえ", "買値"], ["alice", "99"]])
+
+            worksheet = Mock()
+            worksheet.get_all_values.return_value = [
+                ["なまえ", "買値"],
+                ["alice", "100"],
+            ]
+            service = gspreads.GspreadService([worksheet], key="key", store=store)
+            # served from the store, then reconciled in the background
+            self.assertEqual(service.get_table(0)[1], ["alice", "99"])
+            for _ in range(100):
+                if service.snapshots[0][0] is not None:
+                    break
+                time.sleep(0.01)
+            self.assertEqual(service.get_table(0)[1], ["alice", "100"])
+
+            # the last snapshot is served while the sheet is down
+            worksheet.get_all_values.side_effect = gspread.exceptions.APIError(
+                QuotaExceededResponse(503, "unavailable")
+            )
+            service.retries = 0
+            self.assertEqual(service.get_table(0)[1], ["alice", "100"])
+            service.close()
+            store.close()
+            self.assertEqual(
+                SnapshotStore(store.path).load("key")[0].table[1], ["alice", "100"]
+            )
+
+    def test_snapshot_store_live(self):
+        with tempfile.TemporaryDirectory() as directory:
+            store = SnapshotStore(os.path.join(directory, "snapshots.sqlite3"))
+            store.save("key", 0, [["なまえ", "買値"], ["alice", "99"]])
+
+            worksheet = Mock()
+            error = gspread.exceptions.APIError(
+                QuotaExceededResponse(400, "bad request")
+            )
+            worksheet.get_all_values.side_effect = error
+            worksheet.batch_get.side_effect = error
+            service = gspreads.GspreadService([worksheet], key="key", store=store)
+            service.reconcile = Mock()
+            restored = service.get_table(0)
+            self.assertTrue(service.is_restored(0, restored))
+            # not the restored snapshot even if the sheet is down
+            with self.assertRaises(gspread.exceptions.APIError):
+                service.get_table(0, live=True)
+            with self.assertRaises(gspread.exceptions.APIError):
+                service.get_ranges(0, [(1, 1, 1, 2)], live=True)
+
+            worksheet.get_all_values.side_effect = None
+            worksheet.get_all_values.return_value = [
+                ["なまえ", "買値"],
+                ["alice", "100"],
+            ]
+            live = service.get_table(0, live=True)
+            self.assertEqual(live[1], ["alice", "100"])
+            self.assertFalse(service.is_restored(0, live))
+            store.close()
+
+    def test_retry_backoff(self):
+        service, worksheet = gspread_service(cache_ttl=0)
+        service.backoff = 0.001
+        worksheet.get_all_values.side_effect = [
+            gspread.exceptions.APIError(QuotaExceededResponse(429, "quota")),
+            gspread.exceptions.APIError(QuotaExceededResponse(503, "unavailable")),
+            [["なまえ", "買値"]],
+        ]
+        self.assertEqual(service.get_table(0), [["なまえ", "買値"]])
+
+        service.retries = 1
+        worksheet.get_all_values.side_effect = [
+            gspread.exceptions.APIError(QuotaExceededResponse(429, "quota")),
+            gspread.exceptions.APIError(QuotaExceededResponse(429, "quota")),
+        ]
+        with self.assertRaises(gspread.exceptions.APIError):
+            service.get_table(0)
+
+    def test_retry_budget(self):
+        service, worksheet = gspread_service(cache_ttl=0)
+        service.backoff = 10
+        service.backoff_max = 10
+        service.retry_budget = 0.01
+        worksheet.get_all_values.side_effect = gspread.exceptions.APIError(
+            QuotaExceededResponse(429, "quota")
+        )
+        with patch("random.uniform", return_value=1.0):
+            with self.assertRaises(gspread.exceptions.APIError):
+                service.get_table(0)
+        # not retried because the delay is over the budget
+        self.assertEqual(worksheet.get_all_values.call_count, 1)
+
+
+class TestWriteBehindQueue(TestCase):
+    def test_later_write_wins(self):
+        written = []
+        queue = gspreads.WriteBehindQueue(
+            lambda sheet, cells: written.append((sheet, cells)), 10, 60
+        )
+        first = queue.put(0, 2, 3, 100)
+        second = queue.put(0, 2, 3, 110)
+        queue.put(0, 2, 4, 90)
+        queue.close()
+
+        self.assertEqual(written, [(0, [(2, 3, 110), (2, 4, 90)])])
+        self.assertTrue(first.done())
+        self.assertTrue(second.done())
+
+    def test_flush_by_size(self):
+        written = []
+        queue = gspreads.WriteBehindQueue(
+            lambda sheet, cells: written.append((sheet, cells)), 2, 60
+        )
+        queue.put(0, 2, 3, 100)
+        queue.put(1, 2, 3, 100).result(timeout=5)
+        self.assertEqual(sorted(written), [(0, [(2, 3, 100)]), (1, [(2, 3, 100)])])
+        queue.close()
+
+    def test_failure_is_propagated(self):
+        def write(sheet, cells):
+            raise RuntimeError("quota")
+
+        queue = gspreads.WriteBehindQueue(write, 1, 60)
+        with self.assertRaises(RuntimeError):
+            queue.put(0, 2, 3, 100).result(timeout=5)
+        queue.close()
+
+
+class TestGspreadClient(TestCase):
+    def test_retry_unauthorized(self):
+        client = gspreads.GspreadClient(dummy_credential())
+        service, worksheet = gspread_service(cache_ttl=0, client=client)
+        worksheet.get_all_values.side_effect = [
+            gspread.exceptions.APIError(QuotaExceededResponse(401, "expired")),
+            [["なまえ", "買値"]],
+        ]
+        with patch("requests.Session.request", side_effect=token_endpoint()) as post:
+            self.assertEqual(service.get_table(0), [["なまえ", "買値"]])
+        self.assertEqual(post.call_count, 1)
+        self.assertEqual(client.generation, 1)
+        # the session of the client sends the new token
+        self.assertEqual(client.client.session.credentials.token, "token1")
+        self.assertAlmostEqual(client.expires_at - time.monotonic(), 3600, delta=5)
+
+        # refreshed by another thread since the request started
+        with patch("requests.Session.request", side_effect=token_endpoint()) as post:
+            client.refresh(0)
+        post.assert_not_called()
+
+    def test_not_retry_other_errors(self):
+        client = gspreads.GspreadClient(dummy_credential())
+        service, worksheet = gspread_service(cache_ttl=0, client=client)
+        worksheet.update_cell.side_effect = gspread.exceptions.APIError(
+            QuotaExceededResponse(400, "bad request")
+        )
+        with patch("requests.Session.request", side_effect=token_endpoint()) as post:
+            with self.assertRaises(gspread.exceptions.APIError):
+                service.update_cell(0, 1, 1, 100)
+        self.assertEqual(worksheet.update_cell.call_count, 1)
+        post.assert_not_called()
+
+    def test_token_expires_at(self):
+        expiry = datetime.datetime.utcnow() + datetime.timedelta(seconds=3600)
+        expires_at = gspreads.token_expires_at(SimpleNamespace(expiry=expiry))
+        self.assertAlmostEqual(expires_at - time.monotonic(), 3600, delta=1)
+        self.assertIsNone(gspreads.token_expires_at(SimpleNamespace()))
+
+
+def gspread_service(cache_ttl: float, write_behind: bool = False, client=None):
+    worksheet = Mock()
+    service = gspreads.GspreadService(
+        [worksheet],
+        cache_ttl=cache_ttl,
+        write_behind=write_behind,
+        write_interval=0.01,
+        client=client,
+    )
+    return service, worksheet
+
+
+@functools.lru_cache(maxsize=None)
+def dummy_credential() -> dict:
+    """
+    service account credential with a key generated for the test
+    """
+    # rsa is a dependency of oauth2client and google-auth
+    _, key = rsa.newkeys(1024)
+    return {
+        "type": "service_account",
+        "client_email": "bot@example.iam.gserviceaccount.com",
+        "client_id": "1",
+        "private_key_id": "1",
+        "private_key": key.save_pkcs1().decode("ascii"),
+        "token_uri": "https://oauth2.googleapis.com/token",
+    }
+
+
+def token_endpoint():
+    """
+    side effect of requests.Session.request which issues token1, token2, ...
+    """
+    count = 0
+
+    def request(method, url, **kwargs):
+        nonlocal count
+        count += 1
+        body = {"access_token": "token%d" % count, "expires_in": 3600}
+        return SimpleNamespace(
+            status_code=200,
+            headers={"content-type": "application/json"},
+            content=json.dumps(body).encode("utf-8"),
+        )
+
+    return request
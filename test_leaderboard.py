@@ -0,0 +1,71 @@
+import random
+import threading
+from unittest import TestCase
+
+import test_table
+from table import SELL_TERMS, TurnipPriceTableViewService
+
+
+class TestLeaderboard(TestCase):
+    def setUp(self) -> None:
+        self.view = TurnipPriceTableViewService(test_table.test_table("testdata.tsv"))
+        self.left = self.view.find_terms_range()[1]
+
+    def test_top(self):
+        by_price, by_ratio = self.view.leaderboard().top(5, 2)
+        self.assertEqual(by_price[0], ("bob", 495))
+        self.assertEqual(len(by_price), 2)
+        self.assertEqual(by_ratio[0][:2], ("bob", 495))
+        self.assertAlmostEqual(by_ratio[0][2], 495 / 109)
+
+    def test_update(self):
+        ranking = self.view.leaderboard()
+        row = self.view.user_rows["alice"]
+        self.view.update(row, self.left + 5, "600")
+        self.assertEqual(ranking.top(5, 1)[0], [("alice", 600)])
+        # the buy price changes all ratios
+        self.view.update(row, self.left, "50")
+        self.assertEqual(ranking.top(5, 1)[1], [("alice", 600, 12.0)])
+        self.view.update(row, self.left + 5, "")
+        self.assertEqual(ranking.top(5, 1)[0], [("bob", 495)])
+
+    def test_consistent_with_rebuild(self):
+        rng = random.Random(0)
+        ranking = self.view.leaderboard()
+        rows = [self.view.user_rows[name] for name in ["alice", "bob", "charlie"]]
+        for _ in range(200):
+            value = rng.choice(["", "x", str(rng.randint(0, 700))])
+            self.view.update(rng.choice(rows), self.left + rng.randrange(13), value)
+        rebuilt = TurnipPriceTableViewService(self.view.table).leaderboard()
+        for term in range(1, len(SELL_TERMS) + 1):
+            self.assertEqual(ranking.by_price[term], rebuilt.by_price[term])
+            self.assertEqual(ranking.by_ratio[term], rebuilt.by_ratio[term])
+
+    def test_concurrent_updates(self):
+        ranking = self.view.leaderboard()
+        rows = list(self.view.user_rows.values())[3:]
+
+        def write(seed):
+            rng = random.Random(seed)
+            for _ in range(200):
+                value = rng.choice(["", str(rng.randint(0, 700))])
+                self.view.update(rng.choice(rows), self.left + rng.randrange(13), value)
+
+        def read():
+            for _ in range(200):
+                with self.view.lock:
+                    by_price, _ = ranking.top(5, 20)
+                prices = [price for _, price in by_price]
+                self.assertEqual(prices, sorted(prices, reverse=True))
+
+        threads = [threading.Thread(target=write, args=(i,)) for i in range(4)]
+        threads.append(threading.Thread(target=read))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertIs(self.view.leaderboard(), ranking)
+        rebuilt = TurnipPriceTableViewService(self.view.table).leaderboard()
+        for term in range(1, len(SELL_TERMS) + 1):
+            self.assertEqual(ranking.by_price[term], rebuilt.by_price[term])
+            self.assertEqual(ranking.by_ratio[term], rebuilt.by_ratio[term])
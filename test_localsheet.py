@@ -0,0 +1,52 @@
+from unittest import TestCase
+
+import gspread
+
+from gspreads import GspreadService
+from localsheet import LocalWorksheet
+
+
+class TestLocalWorksheet(TestCase):
+    def test_get_table(self):
+        service = GspreadService([LocalWorksheet.from_tsv("testdata.tsv")])
+        table = service.get_table(0)
+        self.assertEqual(table[3][1], "alice")
+        self.assertEqual(table[3][2], "99")
+
+    def test_update(self):
+        worksheet = LocalWorksheet([["なまえ", "買値"], ["alice"]])
+        worksheet.update_cell(2, 2, 100)
+        worksheet.batch_update(
+            [
+                {"range": "C2:D2", "values": [[90, 64]]},
+                {"range": "A3", "values": [["bob"]]},
+            ]
+        )
+        self.assertEqual(
+            worksheet.get_all_values(),
+            [["なまえ", "買値"], ["alice", "100", "90", "64"], ["bob"]],
+        )
+
+    def test_batch_get(self):
+        worksheet = LocalWorksheet(
+            [["なまえ", "買値", "", ""], ["alice", "99", "", ""]]
+        )
+        self.assertEqual(
+            worksheet.batch_get(["A2:D2", "'local'!B1:B2", "C3:D4"]),
+            [[["alice", "99"]], [["買値"], ["99"]], []],
+        )
+
+    def test_quota(self):
+        worksheet = LocalWorksheet([["なまえ"]], read_quota=2)
+        worksheet.get_all_values()
+        worksheet.get_all_values()
+        with self.assertRaises(gspread.exceptions.APIError) as cm:
+            worksheet.get_all_values()
+        self.assertEqual(cm.exception.response.status_code, 429)
+        # writes have their own quota
+        worksheet.update_cell(1, 1, "なまえ")
+
+    def test_error_rate(self):
+        worksheet = LocalWorksheet([["なまえ"]], error_rate=1.0)
+        with self.assertRaises(gspread.exceptions.APIError):
+            worksheet.update_cell(1, 1, "x")
@@ -0,0 +1,55 @@
+import urllib.request
+from unittest import TestCase
+
+from metrics import Histogram, MetricsRegistry
+
+
+class TestHistogram(TestCase):
+    def test_quantile(self):
+        histogram = Histogram([1.0, 2.0, 4.0])
+        for value in [0.5, 1.5, 1.5, 3.0]:
+            histogram.observe(value)
+        self.assertEqual(histogram.count, 4)
+        self.assertEqual(histogram.quantile(0.25), 1.0)
+        self.assertEqual(histogram.quantile(0.5), 1.5)
+        self.assertEqual(histogram.quantile(1.0), 4.0)
+        self.assertEqual(histogram.cumulative_counts(), [1, 3, 4, 4])
+
+    def test_empty(self):
+        self.assertEqual(Histogram().quantile(0.99), 0.0)
+
+
+class TestMetricsRegistry(TestCase):
+    def test_render(self):
+        registry = MetricsRegistry()
+        with registry.span("parse"):
+            pass
+        registry.gauge("hit_ratio", lambda: 0.5, {"cache": "bind"})
+
+        text = registry.render()
+        self.assertIn("# TYPE turnip_stage_seconds histogram", text)
+        self.assertIn('turnip_stage_seconds_bucket{stage="parse",le="+Inf"} 1', text)
+        self.assertIn('turnip_stage_seconds_count{stage="parse"} 1', text)
+        self.assertIn('hit_ratio{cache="bind"} 0.5', text)
+
+    def test_timed(self):
+        registry = MetricsRegistry()
+
+        @registry.timed("double")
+        def double(x):
+            return x * 2
+
+        self.assertEqual(double(2), 4)
+        summary = registry.summaries()['turnip_stage_seconds{stage="double"}']
+        self.assertEqual(summary["count"], 1)
+
+    def test_serve(self):
+        registry = MetricsRegistry()
+        registry.gauge("up", lambda: 1)
+        server = registry.serve(0)
+        try:
+            url = "http://127.0.0.1:%d/metrics" % server.server_address[1]
+            with urllib.request.urlopen(url) as response:
+                self.assertIn("up 1.0", response.read().decode("utf-8"))
+        finally:
+            server.shutdown()
@@ -13,6 +13,15 @@ class TestParseService(TestCase):
     def test_normalize(self):
         self.assertEqual(parse.normalize("＋１００"), "+100")
         self.assertEqual(parse.normalize("ＡＢＣ"), "abc")
+        self.assertEqual(parse.normalize("　＋１００　木ＡＭ　"), "+100 木am")
+        self.assertEqual(parse.normalize(" Hist "), "hist")
+
+    def test_z2h_table(self):
+        chars = "".join(chr(c) for c in range(0x10000) if not 0xD800 <= c <= 0xDFFF)
+        self.assertEqual(
+            chars.translate(parse.Z2H_TABLE),
+            jaconv.z2h(chars, kana=False, digit=True, ascii=True),
+        )
 
     def test_recognize_from_bot(self):
         botuser = bot()
@@ -60,6 +69,27 @@ class TestParseService(TestCase):
         self.assertEqual(service.recognize(make_mention("hist")), parse_result.HistoryRequest())
         self.assertEqual(service.recognize(make_mention("history")), parse_result.HistoryRequest())
 
+    def test_recognize_past(self):
+        service = parse.ParseService(bot())
+        self.assertEqual(service.recognize(make_mention("past")), parse_result.PastHistoryRequest(4))
+        self.assertEqual(service.recognize(make_mention("past 8")), parse_result.PastHistoryRequest(8))
+        self.assertEqual(service.recognize(make_mention("過去　８")), parse_result.PastHistoryRequest(8))
+        self.assertEqual(service.recognize(make_mention("past 0")), parse_result.UnknownRequest())
+        self.assertEqual(service.recognize(make_mention("pasta")), parse_result.UnknownRequest())
+
+    def test_recognize_top(self):
+        service = parse.ParseService(bot())
+        # the same term as test_recognize_update
+        self.assertEqual(service.recognize(make_mention("top")), parse_result.TopRequest("月AM", 5))
+        self.assertEqual(service.recognize(make_mention("top 10")), parse_result.TopRequest("月AM", 10))
+        self.assertEqual(service.recognize(make_mention("topx")), parse_result.UnknownRequest())
+
+    def test_current_term(self):
+        self.assertEqual(parse.current_term(datetime.datetime(2020, 4, 15, 12, 0)), "水PM")
+        self.assertEqual(parse.current_term(datetime.datetime(2020, 4, 16, 4, 59)), "水PM")
+        self.assertEqual(parse.current_term(datetime.datetime(2020, 4, 12, 5, 0)), "買値")
+        self.assertEqual(parse.current_term(datetime.datetime(2020, 4, 12, 4, 0)), "土PM")
+
     def test_recognize_bind(self):
         service = parse.ParseService(bot())
         self.assertEqual(
@@ -181,6 +211,44 @@ class TestParseService(TestCase):
             result = parse.parse_update_command(command, current)
             self.assertEqual(expected, result, message)
 
+    def test_parse_bulk_update_command(self):
+        current = datetime.datetime(2020, 4, 15, 11, 0, 0)
+        testcases = [
+            (
+                "100 100/64 32/- -/- -/- -/- -/-",
+                parse_result.BulkUpdateRequest([100, 100, 64, 32] + [None] * 9),
+                "hist の出力",
+            ),
+            (
+                "- 100/64",
+                parse_result.BulkUpdateRequest([None, 100, 64] + [None] * 10),
+                "途中まで",
+            ),
+            (
+                "100 1/2 3/4 5/6 7/8 9/10 11/12",
+                parse_result.BulkUpdateRequest([100] + list(range(1, 13))),
+                "全部",
+            ),
+            ("100 100/64/32", parse_result.InvalidUpdateRequest(), "区切りが多い"),
+            ("100 100/6a", parse_result.InvalidUpdateRequest(), "数字でない"),
+            ("- -/-", parse_result.InvalidUpdateRequest(), "全部空"),
+            (
+                "100 1/2 3/4 5/6 7/8 9/10 11/12 13/14",
+                parse_result.InvalidUpdateRequest(),
+                "多すぎる",
+            ),
+        ]
+        for command, expected, message in testcases:
+            result = parse.parse_update_command(command, current)
+            self.assertEqual(expected, result, message)
+
+    def test_recognize_bulk_update(self):
+        service = parse.ParseService(bot())
+        self.assertEqual(
+            service.recognize(make_mention("＋１００　１００／６４")),
+            parse_result.BulkUpdateRequest([100, 100, 64] + [None] * 10),
+        )
+
 
 def bot():
     bot = Mock()
@@ -0,0 +1,45 @@
+from unittest import TestCase
+
+import predict
+
+
+class TestPredict(TestCase):
+    def test_unknown(self):
+        result = predict.predict((None,) * 13)
+        self.assertAlmostEqual(sum(result.probabilities), 1.0)
+        # stationary distribution of the transitions
+        self.assertAlmostEqual(result.probabilities[0], 0.346, places=3)
+        self.assertEqual(result.ranges[0][0] > 0, True)
+
+    def test_decreasing(self):
+        history = (100, 88, 85, 82, 79, 76, 73, 70, 67, 64, 61, 58, 55)
+        result = predict.predict(history)
+        self.assertEqual(result.probabilities, [0.0, 0.0, 1.0, 0.0])
+        self.assertEqual(result.ranges[0], (88, 88))
+
+    def test_large_spike(self):
+        history = (109, 94, 89, 121, 207, 495, 167, 111, 76, 95, 63, 45, 81)
+        result = predict.predict(history)
+        self.assertEqual(result.probabilities, [0.0, 1.0, 0.0, 0.0])
+
+    def test_ranges(self):
+        history = (100, 88, 85, 82) + (None,) * 9
+        result = predict.predict(history)
+        self.assertEqual(result.ranges[:3], [(88, 88), (85, 85), (82, 82)])
+        self.assertEqual(result.ranges[3][1], 140)
+        # 跳ね大型 may reach 6 times of the buy price from 水AM
+        self.assertEqual(result.ranges[5][1], 600)
+
+    def test_no_pattern(self):
+        self.assertEqual(predict.predict((100, 200) + (None,) * 11), None)
+
+    def test_memoized(self):
+        history = (100, 90, 86) + (None,) * 10
+        predict.predict.cache_clear()
+        first = predict.predict(history)
+        self.assertIs(predict.predict(history), first)
+        self.assertEqual(predict.predict.cache_info().hits, 1)
+
+    def test_invalid_length(self):
+        with self.assertRaises(ValueError):
+            predict.predict((100,))
@@ -0,0 +1,55 @@
+import math
+from unittest import TestCase
+
+import numpy as np
+
+import test_table
+from price_matrix import MISSING, PriceMatrix
+from table import TurnipPriceTableViewService
+
+
+class TestPriceMatrix(TestCase):
+    def setUp(self) -> None:
+        self.matrix = PriceMatrix.from_cells(
+            ["alice", "bob", "alice"],
+            [
+                ["100", "90", "", "x"] + [""] * 9,
+                ["110", "", "200", "40000"] + [""] * 9,
+                ["1", "2", "3", "4"] + [""] * 9,
+            ],
+        )
+
+    def test_from_cells(self):
+        self.assertEqual(self.matrix.prices.dtype, np.int16)
+        self.assertEqual(
+            self.matrix.prices[0, :4].tolist(), [100, 90, MISSING, MISSING]
+        )
+        # too large for int16
+        self.assertEqual(self.matrix.prices[1, 3], MISSING)
+        self.assertEqual(self.matrix.history("alice")[:3], (100, 90, None))
+        self.assertIsNone(self.matrix.history("carol"))
+
+    def test_aggregates(self):
+        self.assertEqual(self.matrix.term_max()[:4].tolist(), [110, 90, 200, 4])
+        mean = self.matrix.term_mean()
+        self.assertAlmostEqual(mean[0], 211 / 3)
+        self.assertTrue(math.isnan(mean[4]))
+        ratios = self.matrix.ratios()
+        self.assertEqual(ratios.shape, (3, 12))
+        self.assertAlmostEqual(ratios[0, 0], 0.9)
+        self.assertTrue(math.isnan(ratios[1, 0]))
+
+    def test_view(self):
+        view = TurnipPriceTableViewService(test_table.test_table("testdata.tsv"))
+        matrix = view.price_matrix()
+        self.assertEqual(matrix.history("alice"), (99, None, 64) + (None,) * 10)
+        self.assertEqual(
+            matrix.history("bob"),
+            (109, 94, 89, 121, 207, 495, 167, 111, 76, 95, 63, 45, 81),
+        )
+        # kept consistent by update
+        view.update(5, 12, "120")
+        self.assertEqual(matrix.history("charlie")[10], 120)
+        # rebuilt after the layout changed
+        view.update(5, 1, "carol")
+        self.assertEqual(view.price_matrix().history("carol")[10], 120)
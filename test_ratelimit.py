@@ -0,0 +1,58 @@
+import threading
+import time
+from unittest import TestCase
+
+from metrics import MetricsRegistry
+from ratelimit import READ, WRITE, RateLimiter, TokenBucket
+
+
+class TestRateLimiter(TestCase):
+    def test_token_bucket(self):
+        bucket = TokenBucket(rate=10, capacity=2)
+        now = bucket.updated
+        self.assertEqual(bucket.wait_time(now), 0)
+        bucket.take()
+        bucket.take()
+        self.assertAlmostEqual(bucket.wait_time(now), 0.1)
+        self.assertEqual(bucket.wait_time(now + 0.2), 0)
+        # not more than capacity
+        self.assertAlmostEqual(bucket.wait_time(now + 10), 0)
+        self.assertEqual(bucket.tokens, 2)
+
+    def test_acquire(self):
+        registry = MetricsRegistry()
+        limiter = RateLimiter(
+            read_per_minute=600, write_per_minute=None, burst=2, registry=registry
+        )
+        start = time.monotonic()
+        for _ in range(4):
+            limiter.acquire(READ)
+            limiter.acquire(WRITE)
+        # 2 by burst and 2 by 10 per second
+        self.assertGreaterEqual(time.monotonic() - start, 0.15)
+        self.assertEqual(limiter.throttle_times[READ].count, 4)
+        self.assertEqual(limiter.throttle_times[WRITE].count, 0)
+        self.assertIn(
+            'turnip_ratelimit_queue_depth{kind="read"} 0.0', registry.render()
+        )
+
+    def test_writes_first(self):
+        limiter = RateLimiter(
+            read_per_minute=6000,
+            write_per_minute=600,
+            burst=1,
+            registry=MetricsRegistry(),
+        )
+        limiter.acquire(WRITE)
+        order = []
+        write = threading.Thread(
+            target=lambda: (limiter.acquire(WRITE), order.append(WRITE))
+        )
+        write.start()
+        # wait for the write to start waiting
+        while limiter.waiting[WRITE] == 0:
+            time.sleep(0.001)
+        limiter.acquire(READ)
+        order.append(READ)
+        write.join()
+        self.assertEqual(order, [WRITE, READ])
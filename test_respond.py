@@ -0,0 +1,273 @@
+import os
+import tempfile
+from dataclasses import dataclass
+from unittest import TestCase
+from unittest.mock import Mock
+
+import parse_result
+import test_table
+from gspreads import GspreadService
+from localsheet import LocalWorksheet
+from metrics import MetricsRegistry
+from respond import NO_ROUTE_MESSAGE, NOT_BOUND_MESSAGE, RespondService
+from routing import Route, SheetRouter, SpreadsheetPool
+from snapshot_store import SnapshotStore
+from table import SELL_TERMS
+
+
+class TestRespondService(TestCase):
+    def setUp(self) -> None:
+        self.gspread_service = Mock()
+        self.gspread_service.get_table.side_effect = (
+            lambda sheet, live=False: test_table.test_table("testdata.tsv")
+        )
+        self.gspread_service.is_restored.return_value = False
+        self.bind_service = Mock()
+        self.bind_service.find_name.return_value = "bob"
+        pool = SpreadsheetPool(None)
+        pool.add("test", self.gspread_service)
+        self.router = SheetRouter(pool, Route("test"))
+        self.service = RespondService(self.router, self.bind_service, MetricsRegistry())
+
+    def test_respond_to(self):
+        message = Mock()
+        self.assertEqual(
+            self.service.respond_to(message, parse_result.EmptyRequest()), "やぁ☆"
+        )
+        self.assertEqual(
+            self.service.respond_to(message, parse_result.IgnorableRequest("bot")),
+            None,
+        )
+        self.assertEqual(
+            self.service.respond_to(message, parse_result.HistoryRequest()),
+            "bobの履歴: 109 94/89 121/207 495/167 111/76 95/63 45/81",
+        )
+
+    def test_register(self):
+        @dataclass
+        class PingRequest(parse_result.ParseResult):
+            pass
+
+        message = Mock()
+        self.assertEqual(
+            self.service.respond_to(message, PingRequest()), "実装されていません。"
+        )
+        self.service.register(PingRequest, lambda message, request: "pong")
+        self.assertEqual(self.service.respond_to(message, PingRequest()), "pong")
+
+    def test_handler_stats(self):
+        message = Mock()
+        self.service.respond_to(message, parse_result.EmptyRequest())
+        self.service.respond_to(message, parse_result.EmptyRequest())
+        stats = self.service.handler_stats()
+        self.assertEqual(stats["EmptyRequest"]["count"], 2)
+        self.assertEqual(stats["UpdateRequest"]["count"], 0)
+        self.assertGreater(stats["EmptyRequest"]["p99"], 0)
+
+    def test_past_history(self):
+        self.assertEqual(
+            self.service.respond_to(Mock(), parse_result.PastHistoryRequest(4)),
+            "実装されていません。",
+        )
+        archive_service = Mock()
+        archive_service.find_weeks.return_value = [
+            ("2020-04-12", [100, 90, None] + [None] * 10)
+        ]
+        service = RespondService(
+            self.router,
+            self.bind_service,
+            MetricsRegistry(),
+            archive_service=archive_service,
+        )
+        self.assertEqual(
+            service.respond_to(Mock(), parse_result.PastHistoryRequest(20)),
+            "bobの過去1週:\n2020-04-12の週: 100 90/- -/- -/- -/- -/- -/-",
+        )
+        archive_service.find_weeks.assert_called_once_with(Route("test"), "bob", 12)
+        self.bind_service.find_name.return_value = None
+        self.assertEqual(
+            service.respond_to(Mock(), parse_result.PastHistoryRequest(4)),
+            NOT_BOUND_MESSAGE,
+        )
+
+    def test_top(self):
+        self.assertEqual(
+            self.service.respond_to(Mock(), parse_result.TopRequest("水AM", 1)),
+            "水AMの売値ランキング\n価格: 1. bob 495\n買値比: 1. bob 4.54倍 (495)",
+        )
+        self.assertEqual(
+            self.service.respond_to(Mock(), parse_result.TopRequest("買値", 1)),
+            "日曜日はカブを売れません。",
+        )
+
+    def test_prediction(self):
+        self.assertEqual(
+            self.service.respond_to(Mock(), parse_result.PredictionRequest()),
+            "bobの履歴: 109 94/89 121/207 495/167 111/76 95/63 45/81\n型: 跳ね大型 100%",
+        )
+        self.bind_service.find_name.return_value = None
+        self.assertEqual(
+            self.service.respond_to(Mock(), parse_result.PredictionRequest()),
+            NOT_BOUND_MESSAGE,
+        )
+        self.router.default = None
+        self.assertEqual(
+            self.service.respond_to(Mock(), parse_result.PredictionRequest()),
+            NO_ROUTE_MESSAGE,
+        )
+
+    def test_no_route(self):
+        self.router.default = None
+        self.assertEqual(
+            self.service.respond_to(Mock(), parse_result.HistoryRequest()),
+            NO_ROUTE_MESSAGE,
+        )
+        self.gspread_service.get_table.assert_not_called()
+
+
+class TestRangeRead(TestCase):
+    def setUp(self) -> None:
+        self.worksheet = LocalWorksheet(test_table.test_table("testdata.tsv"))
+        self.worksheet.get_all_values = Mock(wraps=self.worksheet.get_all_values)
+        self.worksheet.batch_get = Mock(wraps=self.worksheet.batch_get)
+        pool = SpreadsheetPool(None)
+        pool.add("test", GspreadService([self.worksheet]))
+        bind_service = Mock()
+        bind_service.find_name.return_value = "bob"
+        self.service = RespondService(
+            SheetRouter(pool, Route("test")), bind_service, MetricsRegistry()
+        )
+
+    def history(self) -> str:
+        return self.service.respond_to(Mock(), parse_result.HistoryRequest())
+
+    def test_read_row(self):
+        self.history()
+        self.worksheet.rows[4][3] = "100"
+        self.assertEqual(
+            self.history(), "bobの履歴: 109 100/89 121/207 495/167 111/76 95/63 45/81"
+        )
+        self.assertEqual(self.worksheet.get_all_values.call_count, 1)
+        self.assertEqual(self.worksheet.batch_get.call_count, 1)
+
+    def test_layout_changed(self):
+        self.history()
+        self.worksheet.rows.insert(3, ["0", "carol"])
+        self.assertEqual(
+            self.history(), "bobの履歴: 109 94/89 121/207 495/167 111/76 95/63 45/81"
+        )
+        self.assertEqual(self.worksheet.get_all_values.call_count, 2)
+
+    def test_users_column_right(self):
+        terms = ["買値"] + SELL_TERMS
+        rows = [terms + ["なまえ"], ["99", "90"] + [""] * 11 + ["alice"]]
+        pool = SpreadsheetPool(None)
+        pool.add("right", GspreadService([LocalWorksheet(rows)]))
+        bind_service = Mock()
+        bind_service.find_name.return_value = "alice"
+        service = RespondService(
+            SheetRouter(pool, Route("right")), bind_service, MetricsRegistry()
+        )
+        for _ in range(2):
+            self.assertEqual(
+                service.respond_to(Mock(), parse_result.HistoryRequest()),
+                "aliceの履歴: 99 90/- -/- -/- -/- -/- -/-",
+            )
+
+    def test_bulk_update(self):
+        self.worksheet.batch_update = Mock(wraps=self.worksheet.batch_update)
+        request = parse_result.BulkUpdateRequest([100, 100, 64, 32] + [None] * 9)
+        self.assertEqual(
+            self.service.respond_to(Mock(), request),
+            "スプレッドシートに書きました。\n"
+            "書き込んだセル数: 4 | スプレッドシートでの名前: `bob`\n"
+            "履歴: 100 100/64 32/207 495/167 111/76 95/63 45/81",
+        )
+        self.worksheet.batch_update.assert_called_once()
+        self.assertEqual(self.worksheet.rows[4][2:6], ["100", "100", "64", "32"])
+
+        self.service.bind_service.find_name.return_value = None
+        self.assertEqual(self.service.respond_to(Mock(), request), NOT_BOUND_MESSAGE)
+        self.worksheet.batch_update.assert_called_once()
+
+    def test_view_expired(self):
+        self.history()
+        # edited by hand, not in the row of the user
+        self.worksheet.rows[5][5] = "300"
+        self.service.view_ttl = 0
+        self.history()
+        self.assertEqual(self.worksheet.get_all_values.call_count, 2)
+        self.assertEqual(self.worksheet.batch_get.call_count, 0)
+        view = self.service.table_views[Route("test")][1]
+        self.assertEqual(view.table[5][5], "300")
+
+    def test_render_history_cached(self):
+        self.history()
+        self.worksheet.batch_get = Mock(wraps=self.worksheet.batch_get)
+        view = self.service.table_views[Route("test")][1]
+        view.find_user_history = Mock(wraps=view.find_user_history)
+        self.history()
+        view.find_user_history.assert_not_called()
+
+        self.worksheet.rows[4][14] = "100"
+        self.assertEqual(
+            self.history(), "bobの履歴: 109 94/89 121/207 495/167 111/76 95/63 45/100"
+        )
+        self.assertEqual(view.find_user_history.call_count, 1)
+
+
+class TestRestoredSnapshot(TestCase):
+    def test_update_on_live_layout(self):
+        rows = test_table.test_table("testdata.tsv")
+        worksheet = LocalWorksheet(rows)
+        with tempfile.TemporaryDirectory() as directory:
+            store = SnapshotStore(os.path.join(directory, "snapshots.sqlite3"))
+            # saved before a row was removed above bob
+            store.save("test", 0, rows[:4] + [["0", "carol"]] + rows[4:])
+            service = GspreadService([worksheet], key="test", store=store)
+            service.reconcile = Mock()
+            pool = SpreadsheetPool(None)
+            pool.add("test", service)
+            bind_service = Mock()
+            bind_service.find_name.return_value = "bob"
+            respond = RespondService(
+                SheetRouter(pool, Route("test")), bind_service, MetricsRegistry()
+            )
+
+            # reads are served from the restored snapshot
+            respond.respond_to(Mock(), parse_result.HistoryRequest())
+            self.assertTrue(respond.table_views[Route("test")][3])
+            respond.respond_to(Mock(), parse_result.UpdateRequest("月AM", 100))
+            self.assertEqual(worksheet.rows[4][3], "100")
+            self.assertEqual(worksheet.rows[5][3], rows[5][3])
+            store.close()
+
+    def test_outage_after_expiry(self):
+        worksheet = LocalWorksheet(test_table.test_table("testdata.tsv"))
+        with tempfile.TemporaryDirectory() as directory:
+            store = SnapshotStore(os.path.join(directory, "snapshots.sqlite3"))
+            service = GspreadService([worksheet], key="test", store=store, retries=0)
+            pool = SpreadsheetPool(None)
+            pool.add("test", service)
+            bind_service = Mock()
+            bind_service.find_name.return_value = "bob"
+            respond = RespondService(
+                SheetRouter(pool, Route("test")),
+                bind_service,
+                MetricsRegistry(),
+                view_ttl=0,
+            )
+            requests = [
+                parse_result.HistoryRequest(),
+                parse_result.TopRequest("水AM", 1),
+            ]
+            replies = [respond.respond_to(Mock(), request) for request in requests]
+
+            # the view has expired,
+            # and the last snapshot is served while the sheet is down
+            worksheet.error_rate = 1
+            for request, reply in zip(requests, replies):
+                self.assertEqual(respond.respond_to(Mock(), request), reply)
+            self.assertEqual(service.cache_misses, 4)
+            service.close()
+            store.close()
@@ -0,0 +1,58 @@
+from types import SimpleNamespace
+from unittest import TestCase
+from unittest.mock import Mock
+
+from routing import Route, SheetRouter, SpreadsheetPool
+
+
+class TestRouting(TestCase):
+    def setUp(self) -> None:
+        self.opener = Mock(side_effect=lambda key: [Mock(), Mock()])
+        self.pool = SpreadsheetPool(self.opener, cache_ttl=60)
+        self.router = SheetRouter.from_config(
+            self.pool,
+            [
+                {"guild": 1, "spreadsheet": "a"},
+                {"guild": 2, "spreadsheet": "b", "sheet": 1},
+                {"channel": 10, "spreadsheet": "c"},
+            ],
+            Route("default"),
+        )
+
+    def test_resolve(self):
+        self.assertEqual(self.router.resolve(message(1, 11)), Route("a", 0))
+        self.assertEqual(self.router.resolve(message(2, 11)), Route("b", 1))
+        # channel is prior to guild
+        self.assertEqual(self.router.resolve(message(1, 10)), Route("c", 0))
+        self.assertEqual(self.router.resolve(message(3, 11)), Route("default"))
+        # direct message
+        self.assertEqual(self.router.resolve(message(None, 12)), Route("default"))
+
+    def test_routes(self):
+        self.assertEqual(
+            self.router.routes(),
+            [Route("default"), Route("c"), Route("a"), Route("b", 1)],
+        )
+
+    def test_from_config(self):
+        with self.assertRaises(ValueError):
+            SheetRouter.from_config(self.pool, [{"spreadsheet": "a"}], None)
+
+    def test_pool(self):
+        a = self.router.service(Route("a", 0))
+        self.assertIs(self.router.service(Route("a", 1)), a)
+        self.assertIsNot(self.router.service(Route("b", 0)), a)
+        # opened at the first request
+        self.opener.assert_not_called()
+        a.worksheet(1)
+        a.worksheet(0)
+        self.opener.assert_called_once_with("a")
+        self.assertEqual(a.cache_ttl, 60)
+        self.assertEqual(len(a.worksheets), 2)
+
+
+def message(guild_id, channel_id) -> SimpleNamespace:
+    return SimpleNamespace(
+        guild=None if guild_id is None else SimpleNamespace(id=guild_id),
+        channel=SimpleNamespace(id=channel_id),
+    )
@@ -0,0 +1,30 @@
+import os
+import tempfile
+from unittest import TestCase
+
+from snapshot_store import SnapshotStore
+
+
+class TestSnapshotStore(TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "snapshots.sqlite3")
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def test_save_and_load(self):
+        store = SnapshotStore(self.path)
+        store.save("key", 0, [["なまえ", "買値"], ["alice", "99"]])
+        store.save_async("key", 0, [["なまえ", "買値"], ["alice", "100"]]).result()
+        store.save("key", 1, [["bob"]])
+        store.save("other", 0, [["carol"]])
+        store.close()
+
+        loaded = SnapshotStore(self.path).load("key")
+        self.assertEqual(loaded[0].table, [["なまえ", "買値"], ["alice", "100"]])
+        self.assertEqual(loaded[0].version, 2)
+        self.assertEqual(loaded[1].table, [["bob"]])
+        self.assertEqual(loaded[1].version, 1)
+        self.assertGreater(loaded[0].saved_at, 0)
+        self.assertEqual(SnapshotStore(self.path).load("none"), {})
@@ -78,6 +78,49 @@ class TestTurnipPriceTableViewService(TestCase):
             result, ["99", "", "64", "", "", "", "", "", "", "", "", "", ""]
         )
 
+    def test_update(self):
+        service_ = service()
+        service_.update(5, 12, "120")
+        self.assertEqual(service_.find_user_history("charlie")[10], "120")
+
+        # rename a user
+        service_.update(5, 1, "carol")
+        self.assertEqual(service_.find_position("carol", "金PM"), table.Found(5, 12))
+        self.assertTrue(
+            isinstance(service_.find_position("charlie", "金PM"), table.UserNotFound)
+        )
+
+    def test_versions(self):
+        service_ = service()
+        service_.update(5, 12, "120")
+        service_.update(5, 12, "120")
+        self.assertEqual(service_.row_versions, {5: 2})
+        self.assertEqual(service_.layout_version, 0)
+        service_.update(5, 1, "carol")
+        self.assertEqual(service_.layout_version, 1)
+
+    def test_update_already_written(self):
+        service_ = service()
+        # the cell may already hold the value, e.g. patched by another writer
+        service_.table[5][1] = "carol"
+        service_.update(5, 1, "carol")
+        self.assertEqual(service_.find_position("carol", "金PM"), table.Found(5, 12))
+        self.assertEqual(service_.layout_version, 1)
+
+    def test_short_rows(self):
+        service_ = TurnipPriceTableViewService(
+            [["", "なまえ", "買値", "月AM"], ["", "alice", "99"], [""]]
+        )
+        self.assertEqual(service_.find_position("alice", "月AM"), table.Found(1, 3))
+        self.assertEqual(service_.find_users(), ["alice", ""])
+
+    def test_not_modify_table(self):
+        raw = [["", "なまえ", "買値", "月AM"], ["", "alice", "99"]]
+        service_ = TurnipPriceTableViewService(raw)
+        service_.update(1, 3, "100")
+        self.assertEqual(raw, [["", "なまえ", "買値", "月AM"], ["", "alice", "99"]])
+        self.assertEqual(service_.find_user_history("alice")[:2], ["99", "100"])
+
 
 def service() -> TurnipPriceTableViewService:
     return TurnipPriceTableViewService(test_table("testdata.tsv"))